@@ -0,0 +1,8 @@
+"""
+Benchmarks of korsub. Run from the repository root.
+
+    python -m benchmarks.synthetic --n-sents 100000 --output-dir bench_data
+    python -m benchmarks.stages --size small --output results.json
+    python -m benchmarks.compare base.json results.json
+    python -m benchmarks.import_time
+"""
@@ -0,0 +1,36 @@
+"""
+Compare two results of benchmarks.stages
+
+    python -m benchmarks.compare base.json new.json
+"""
+
+import argparse
+import json
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('base', type=str)
+    parser.add_argument('new', type=str)
+    args = parser.parse_args()
+
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.new, encoding='utf-8') as f:
+        new = json.load(f)
+
+    print('base = {} ({}), new = {} ({})'.format(
+        base['commit'], base['size'], new['commit'], new['size']))
+    base_records = {r['stage']: r for r in base['records']}
+    print('{:32} {:>10} {:>10} {:>8} {:>12} {:>12}'.format(
+        'stage', 'base s', 'new s', 'speedup', 'base +MB', 'new +MB'))
+    for r in new['records']:
+        b = base_records.get(r['stage'])
+        if b is None:
+            continue
+        speedup = b['seconds'] / r['seconds'] if r['seconds'] > 0 else float('inf')
+        print('{:32} {:10.3f} {:10.3f} {:7.2f}x {:12.1f} {:12.1f}'.format(
+            r['stage'], b['seconds'], r['seconds'], speedup,
+            b['peak_increase_mb'], r['peak_increase_mb']))
+
+if __name__ == '__main__':
+    main()
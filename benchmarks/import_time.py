@@ -0,0 +1,80 @@
+"""
+Startup-time regression benchmark of korsub imports
+
+Usage
+-----
+    python -m benchmarks.import_time --repeat 10 --output import_time.json
+
+Each statement is run in a fresh interpreter. It reports the median wall time
+of the statement and fails when a lazy statement loads heavy dependencies
+(scikit-learn, scipy, psutil) or when the median time exceeds --max-ms.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ['sklearn', 'scipy', 'psutil']
+
+# (statement, whether heavy dependencies must not be imported)
+STATEMENTS = [
+    ('import korsub', True),
+    ('from korsub.text_corpus import Sentences', True),
+    ('from korsub.tagged_corpus import FourColumnCorpus, lr_sents_to_features', True),
+    ('from korsub.tagged_corpus import scan_subwords, count_word_features', True),
+    ('from korsub import LR2Vec', False),
+]
+
+_PROBE = '''
+import sys, time, json
+begin = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - begin
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+'''
+
+def measure(statement, repeat):
+    times = []
+    heavy = []
+    for _ in range(repeat):
+        code = _PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+        output = subprocess.run([sys.executable, '-c', code],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().split('\n')[-1])
+        times.append(result['seconds'])
+        heavy = result['heavy']
+    times.sort()
+    return {'median_ms': 1000 * times[len(times) // 2],
+            'min_ms': 1000 * times[0], 'heavy_modules': heavy}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=-1,
+        help='fail if median time of a lazy statement exceeds it')
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    results = []
+    failed = False
+    for statement, lazy in STATEMENTS:
+        result = measure(statement, args.repeat)
+        result.update({'statement': statement, 'lazy': lazy})
+        if lazy and result['heavy_modules']:
+            failed = True
+        if lazy and args.max_ms > 0 and result['median_ms'] > args.max_ms:
+            failed = True
+        results.append(result)
+        print('{:8.1f} ms  {}{}'.format(result['median_ms'], statement,
+            '  heavy = {}'.format(result['heavy_modules']) if result['heavy_modules'] else ''))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
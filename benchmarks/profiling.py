@@ -0,0 +1,66 @@
+import contextlib
+import io
+import os
+import threading
+import time
+
+
+class MemorySampler:
+    """
+    Samples RSS of current process in a background thread and keeps the peak.
+
+    Usage
+    -----
+        with MemorySampler() as sampler:
+            # do something
+        sampler.peak_rss_mb, sampler.begin_rss_mb
+    """
+
+    def __init__(self, interval=0.01):
+        import psutil
+        self.interval = interval
+        self._process = psutil.Process(os.getpid())
+        self._stop = threading.Event()
+        self.begin_rss_mb = 0
+        self.peak_rss_mb = 0
+
+    def _rss_mb(self):
+        return self._process.memory_info().rss / 1024 ** 2
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss_mb = max(self.peak_rss_mb, self._rss_mb())
+
+    def __enter__(self):
+        self.begin_rss_mb = self.peak_rss_mb = self._rss_mb()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss_mb = max(self.peak_rss_mb, self._rss_mb())
+
+
+def profile(name, func, *args, quiet=True, **kwargs):
+    """
+    It runs func(*args, **kwargs) and returns (output, record).
+    record has wall time, RSS at begin / end and peak RSS in MB.
+    If quiet is True, stdout of func is discarded.
+    """
+
+    stdout = io.StringIO() if quiet else None
+    with MemorySampler() as sampler:
+        begin = time.perf_counter()
+        with contextlib.redirect_stdout(stdout) if quiet else contextlib.nullcontext():
+            output = func(*args, **kwargs)
+        seconds = time.perf_counter() - begin
+    record = {
+        'stage': name,
+        'seconds': seconds,
+        'begin_rss_mb': sampler.begin_rss_mb,
+        'peak_rss_mb': sampler.peak_rss_mb,
+        'peak_increase_mb': sampler.peak_rss_mb - sampler.begin_rss_mb,
+    }
+    return output, record
@@ -0,0 +1,154 @@
+"""
+Stage-level benchmark of korsub
+
+    python -m benchmarks.stages --size small --output results.json
+    python -m benchmarks.compare base.json results.json
+
+Each stage is timed and memory-profiled on synthetic corpora generated by
+benchmarks.synthetic. Results are written as json with the git commit,
+so they can be compared across commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from .profiling import profile
+from .synthetic import SyntheticCorpus
+
+SIZES = {
+    'tiny': {'n_sents': 2000, 'n_l': 2000, 'n_r': 100, 'n_components': 20},
+    'small': {'n_sents': 50000, 'n_l': 20000, 'n_r': 500, 'n_components': 100},
+    'medium': {'n_sents': 500000, 'n_l': 100000, 'n_r': 2000, 'n_components': 300},
+    'large': {'n_sents': 5000000, 'n_l': 400000, 'n_r': 5000, 'n_components': 300},
+}
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+            text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def prepare(data_dir, size, seed=0):
+    config = SIZES[size]
+    text_path = '{}/{}_{}_text.txt'.format(data_dir, size, seed)
+    tagged_path = '{}/{}_{}_tagged.txt'.format(data_dir, size, seed)
+    if not (os.path.exists(text_path) and os.path.exists(tagged_path)):
+        corpus = SyntheticCorpus(config['n_l'], config['n_r'], seed=seed)
+        corpus.write(config['n_sents'], text_path=text_path, tagged_path=tagged_path)
+    return text_path, tagged_path
+
+def run_text_corpus(text_path, records):
+    from korsub.text_corpus import Sentences, scan_subwords, subword_features
+
+    sentences = Sentences(text_path)
+    (subwords, features), record = profile('text.scan_subwords',
+        scan_subwords, sentences, min_count=10, verbose=False)
+    records.append(record)
+
+    _, record = profile('text.subword_features',
+        subword_features, sentences, subwords, features, verbose=False)
+    records.append(record)
+
+def run_tagged_corpus(tagged_path, n_components, records):
+    from korsub.tagged_corpus import FourColumnCorpus, FourColumnLRCorpusDecorator
+    from korsub.tagged_corpus import scan_subwords, scan_features
+    from korsub.tagged_corpus import lr_sents_to_features, count_word_features
+    from korsub.tagged_corpus.train import train_lr2vec
+    from korsub.math import train_pmi, train_svd
+    from korsub.utils import c_to_x, most_similar
+
+    lr_corpus = FourColumnLRCorpusDecorator(FourColumnCorpus(tagged_path))
+
+    lr_sents, record = profile('tagged.parse', list, lr_corpus)
+    records.append(record)
+
+    def to_features(lr_sents):
+        n = 0
+        for lrs in lr_sents:
+            n += len(lr_sents_to_features(lrs, None, None))
+        return n
+    _, record = profile('tagged.lr_sents_to_features', to_features, lr_sents)
+    records.append(record)
+
+    (idx_to_l, l_to_idx, _, idx_to_r, r_to_idx, _), record = profile(
+        'tagged.scan_subwords', scan_subwords, lr_sents, 10)
+    records.append(record)
+
+    (_, feature_to_idx), record = profile('tagged.scan_features',
+        scan_features, lr_sents, l_to_idx, r_to_idx, 5, verbose=False)
+    records.append(record)
+
+    sub_dic = set(idx_to_l)
+    sub_dic.update(idx_to_r)
+    C, record = profile('tagged.count_word_features',
+        count_word_features, lr_sents, sub_dic, feature_to_idx, 2, verbose=False)
+    records.append(record)
+
+    (X, idx_to_row, _), record = profile('c_to_x', c_to_x, C)
+    records.append(record)
+    del C
+
+    (pmi, _, _), record = profile('train_pmi', train_pmi, X, beta=0.75)
+    records.append(record)
+
+    n_components = min(n_components, min(pmi.shape) - 1)
+    (U, Sigma, _), record = profile('train_svd', train_svd, pmi, n_components, random_state=0)
+    records.append(record)
+
+    wv = U * (Sigma ** 0.5)
+    row_to_idx = {row:idx for idx, row in enumerate(idx_to_row)}
+    def queries(n=100):
+        for row in idx_to_row[:n]:
+            most_similar(row, wv, row_to_idx, idx_to_row, topk=10)
+    _, record = profile('most_similar x100', queries)
+    records.append(record)
+
+    _, record = profile('train_lr2vec (end-to-end)', train_lr2vec,
+        lr_corpus, n_components=n_components, verbose=False)
+    records.append(record)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=str, default='small', choices=list(SIZES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', type=str, default=None,
+        help='directory of synthetic corpora. They are reused if exist')
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--skip-text', dest='text', action='store_false')
+    parser.add_argument('--skip-tagged', dest='tagged', action='store_false')
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or '{}/korsub_bench'.format(tempfile.gettempdir())
+    os.makedirs(data_dir, exist_ok=True)
+    text_path, tagged_path = prepare(data_dir, args.size, args.seed)
+
+    records = []
+    if args.text:
+        run_text_corpus(text_path, records)
+    if args.tagged:
+        run_tagged_corpus(tagged_path, SIZES[args.size]['n_components'], records)
+
+    for r in records:
+        print('{:32} {:10.3f} s {:10.1f} MB peak (+{:.1f})'.format(
+            r['stage'], r['seconds'], r['peak_rss_mb'], r['peak_increase_mb']))
+
+    results = {
+        'commit': _git_commit(),
+        'size': args.size,
+        'seed': args.seed,
+        'config': SIZES[args.size],
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'records': records,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Reproducible synthetic Korean corpora for benchmarks
+
+L and R subwords are random strings of Hangul syllables. Each eojeol is L + R
+where L and R are sampled from Zipfian distributions, and about `p_no_r` of
+eojeols have no R.
+
+    python -m benchmarks.synthetic --n-sents 100000 --output-dir bench_data
+"""
+
+import argparse
+import os
+import numpy as np
+
+HANGUL_BEGIN = 0xAC00
+N_HANGUL = 11172
+
+
+class SyntheticCorpus:
+    """
+    Arguments
+    ---------
+    n_l : int
+        Number of distinct L subwords
+    n_r : int
+        Number of distinct R subwords
+    zipf_a : float
+        Exponent of Zipfian distribution. p(rank) ~ rank ^ -zipf_a
+    n_syllables : int
+        Number of Hangul syllables used to generate subwords
+    p_no_r : float
+        Probability that an eojeol has no R
+    sent_length : tuple of int
+        (min, max) number of eojeols in a sentence
+    seed : int
+        Random seed
+    """
+
+    def __init__(self, n_l=20000, n_r=500, zipf_a=1.1, n_syllables=800,
+        p_no_r=0.3, sent_length=(3, 15), seed=0):
+
+        self.rng = np.random.RandomState(seed)
+        self.sent_length = sent_length
+        self.p_no_r = p_no_r
+        self.zipf_a = zipf_a
+        syllables = [chr(HANGUL_BEGIN + i) for i in
+                     self.rng.choice(N_HANGUL, n_syllables, replace=False)]
+        self.idx_to_l = self._subwords(syllables, n_l, (1, 4))
+        self.idx_to_r = self._subwords(syllables, n_r, (1, 3))
+        self.pl = self._zipf(len(self.idx_to_l))
+        self.pr = self._zipf(len(self.idx_to_r))
+
+    def _subwords(self, syllables, n, length):
+        subwords = {}
+        while len(subwords) < n:
+            size = self.rng.randint(length[0], length[1] + 1)
+            sub = ''.join(syllables[i] for i in self.rng.randint(len(syllables), size=size))
+            subwords[sub] = True
+        return list(subwords)
+
+    def _zipf(self, n):
+        p = 1 / np.arange(1, n + 1) ** self.zipf_a
+        return p / p.sum()
+
+    def sentences(self, n_sents, block_size=10000):
+        """
+        It yields list of (L, R) tuples. Sentences are sampled in blocks of
+        fixed size, so the first n sentences are same for any n_sents >= n
+        """
+        for b in range(0, n_sents, block_size):
+            n = min(block_size, n_sents - b)
+            lengths = self.rng.randint(self.sent_length[0], self.sent_length[1] + 1, size=block_size)
+            total = int(lengths.sum())
+            ls = self.rng.choice(len(self.idx_to_l), total, p=self.pl).tolist()
+            rs = self.rng.choice(len(self.idx_to_r), total, p=self.pr).tolist()
+            no_r = (self.rng.random_sample(total) < self.p_no_r).tolist()
+            pos = 0
+            for length in lengths[:n].tolist():
+                yield [(self.idx_to_l[ls[i]], '' if no_r[i] else self.idx_to_r[rs[i]])
+                       for i in range(pos, pos + length)]
+                pos += length
+
+    def write(self, n_sents, text_path=None, tagged_path=None):
+        """
+        Arguments
+        ---------
+        n_sents : int
+            Number of sentences
+        text_path : str or None
+            Path of whitespace tokenized corpus for korsub.text_corpus.Sentences
+        tagged_path : str or None
+            Path of four column corpus for korsub.tagged_corpus.FourColumnCorpus
+        """
+
+        ftext = open(text_path, 'w', encoding='utf-8') if text_path else None
+        ftagged = open(tagged_path, 'w', encoding='utf-8') if tagged_path else None
+        try:
+            for lrs in self.sentences(n_sents):
+                if ftext:
+                    ftext.write('{}\n'.format(' '.join(l + r for l, r in lrs)))
+                if ftagged:
+                    for l, r in lrs:
+                        morphtags = '{}/NNG {}/JKB'.format(l, r) if r else '{}/NNG'.format(l)
+                        lr = '{}/Noun {}/Josa'.format(l, r) if r else '{}/Noun'.format(l)
+                        ftagged.write('{}\t{}\t{}\t{}\n'.format(l + r, morphtags, lr, lr))
+                    ftagged.write('\n')
+        finally:
+            if ftext:
+                ftext.close()
+            if ftagged:
+                ftagged.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-sents', type=int, default=100000)
+    parser.add_argument('--n-l', type=int, default=20000)
+    parser.add_argument('--n-r', type=int, default=500)
+    parser.add_argument('--zipf-a', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output-dir', type=str, default='bench_data')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    corpus = SyntheticCorpus(args.n_l, args.n_r, args.zipf_a, seed=args.seed)
+    corpus.write(args.n_sents,
+        text_path='{}/text.txt'.format(args.output_dir),
+        tagged_path='{}/tagged.txt'.format(args.output_dir))
+
+if __name__ == '__main__':
+    main()
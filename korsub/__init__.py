@@ -1,9 +1,24 @@
-from . import tagged_corpus
-from . import text_corpus
+from ._lazy import lazy_attributes
 
-from .embedding import LR2Vec
-from .math import train_pmi
-from .math import train_svd
-from .utils import get_process_memory
-from .utils import most_similar
-from .utils import c_to_x
\ No newline at end of file
+# Submodules are imported on first attribute access, so that
+# `import korsub` does not load scikit-learn, scipy and psutil
+_attributes = {
+    'tagged_corpus': ('.tagged_corpus', None),
+    'text_corpus': ('.text_corpus', None),
+    'LR2Vec': ('.embedding', 'LR2Vec'),
+    'train_pmi': ('.math', 'train_pmi'),
+    'train_svd': ('.math', 'train_svd'),
+    'estimate_svd_memory': ('.math', 'estimate_svd_memory'),
+    'get_process_memory': ('.utils', 'get_process_memory'),
+    'most_similar': ('.utils', 'most_similar'),
+    'c_to_x': ('.utils', 'c_to_x'),
+    'Instrument': ('.instrument', 'Instrument'),
+    'PrintInstrument': ('.instrument', 'PrintInstrument'),
+    'LoggingInstrument': ('.instrument', 'LoggingInstrument'),
+    'JsonLinesInstrument': ('.instrument', 'JsonLinesInstrument'),
+    'CallbackInstrument': ('.instrument', 'CallbackInstrument'),
+    'CheckpointCache': ('.checkpoint', 'CheckpointCache'),
+    'corpus_fingerprint': ('.checkpoint', 'corpus_fingerprint'),
+}
+__all__ = list(_attributes)
+__getattr__, __dir__ = lazy_attributes(__name__, _attributes)
@@ -0,0 +1,39 @@
+from importlib import import_module
+
+
+def lazy_attributes(package, attributes):
+    """
+    Arguments
+    ---------
+    package : str
+        __name__ of the package
+    attributes : dict
+        {name: (module, attribute)}. module is relative to package.
+        If attribute is None, the module itself is the value
+
+    Returns
+    -------
+    __getattr__ and __dir__ functions of the package (PEP 562)
+
+    Usage
+    -----
+        __getattr__, __dir__ = lazy_attributes(__name__, {
+            'LR2Vec': ('.embedding', 'LR2Vec')
+        })
+    """
+
+    def __getattr__(name):
+        if not (name in attributes):
+            raise AttributeError('module {!r} has no attribute {!r}'.format(package, name))
+        module, attribute = attributes[name]
+        value = import_module(module, package)
+        if attribute is not None:
+            value = getattr(value, attribute)
+        # cache in module namespace. __getattr__ is not called again
+        setattr(import_module(package), name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(vars(import_module(package))) | set(attributes))
+
+    return __getattr__, __dir__
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+
+class CheckpointCache:
+    """
+    Arguments
+    ---------
+    path : str
+        Cache directory
+    max_size : float or None
+        Maximum size (MB) of the cache. When it is exceeded after saving,
+        least recently used checkpoints are removed. Default is None (no limit)
+
+    Usage
+    -----
+        cache = CheckpointCache('~/.cache/korsub', max_size=20480)
+        key = cache.key('count_word_features', parent_key, min_count=2)
+        if cache.contains('count_word_features', key):
+            X = cache.load('count_word_features', key, lambda path: load_csr(path, 'X'))
+        else:
+            X = ...
+            cache.save('count_word_features', key, lambda path: save_csr(path, 'X', X))
+
+    Description
+    -----------
+    Each checkpoint is a directory {path}/{stage}-{key} with meta.json. Its key is
+    a hash of the parent key and the parameters of the stage, so a checkpoint is
+    reused only when the corpus and all parameters of the stage and its
+    upstream stages are same. Checkpoints are written in a temporary directory
+    and renamed, so a stopped run does not leave partial checkpoints.
+    The modification time of meta.json is the last access time used for LRU eviction.
+    """
+
+    def __init__(self, path, max_size=None):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+
+    def key(self, stage, parent, **params):
+        """It returns hash of stage name, parent key and parameters"""
+        return _hash({'stage': stage, 'parent': parent, 'params': params})
+
+    def _dir(self, stage, key):
+        return '{}/{}-{}'.format(self.path, stage, key)
+
+    def contains(self, stage, key):
+        return os.path.exists('{}/meta.json'.format(self._dir(stage, key)))
+
+    def load(self, stage, key, loader):
+        """
+        It returns loader(checkpoint directory) and marks the checkpoint as
+        recently used. If the checkpoint does not exist or is broken, it returns None
+        """
+        path = self._dir(stage, key)
+        if not self.contains(stage, key):
+            return None
+        try:
+            returns = loader(path)
+        except (OSError, ValueError, KeyError):
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.utime('{}/meta.json'.format(path))
+        return returns
+
+    def save(self, stage, key, saver, **info):
+        """Call saver(directory) to write files and register them as the checkpoint"""
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.path)
+        try:
+            saver(tmp)
+            meta = {'stage': stage, 'key': key, 'created': time.time()}
+            meta.update(info)
+            with open('{}/meta.json'.format(tmp), 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            path = self._dir(stage, key)
+            shutil.rmtree(path, ignore_errors=True)
+            os.rename(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict(keep={path})
+
+    def entries(self):
+        """
+        Returns
+        -------
+        entries : list of (path, size, last_access)
+            Size is bytes. Sorted by last access time in increasing order
+        """
+        entries = []
+        for name in os.listdir(self.path):
+            path = '{}/{}'.format(self.path, name)
+            meta = '{}/meta.json'.format(path)
+            if name.startswith('.') or not os.path.exists(meta):
+                continue
+            size = sum(os.path.getsize('{}/{}'.format(path, f)) for f in os.listdir(path))
+            entries.append((path, size, os.path.getmtime(meta)))
+        return sorted(entries, key=lambda x:x[2])
+
+    def evict(self, keep=()):
+        """Remove least recently used checkpoints until the cache size is at most max_size"""
+        if not self.max_size:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size * 1024 ** 2:
+                break
+            if path in keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove all checkpoints"""
+        for path, _, _ in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def corpus_fingerprint(corpus, digest=False):
+    """
+    Arguments
+    ---------
+    corpus : FourColumnCorpus, CompiledLRCorpus, Sentences or their decorator
+        Corpus of which files are known
+    digest : Boolean
+        If True, the contents of the files are hashed.
+        Else, the path, size and modification time of the files are hashed
+
+    Returns
+    -------
+    fingerprint : str or None
+        None if corpus is not backed by files, such as list of sentences
+    """
+
+    # FourColumnLRCorpusDecorator and other decorators keep the corpus
+    while hasattr(corpus, 'corpus'):
+        corpus = corpus.corpus
+
+    if hasattr(corpus, 'paths'):
+        paths = [corpus.paths] if isinstance(corpus.paths, str) else list(corpus.paths)
+    elif hasattr(corpus, 'path') and os.path.isdir(corpus.path):
+        # CompiledLRCorpus directory
+        paths = sorted('{}/{}'.format(corpus.path, f) for f in os.listdir(corpus.path))
+    elif hasattr(corpus, 'path'):
+        paths = [corpus.path]
+    else:
+        return None
+
+    # parameters which change the sentences
+    options = {name: getattr(corpus, name) for name in
+               ('xsv_as_adj', 'num_sent', 'begin', 'end')
+               if isinstance(getattr(corpus, name, None), (bool, int))}
+    files = []
+    for path in paths:
+        stat = os.stat(path)
+        if digest:
+            files.append((os.path.abspath(path), _file_digest(path)))
+        else:
+            files.append((os.path.abspath(path), stat.st_size, stat.st_mtime_ns))
+    return _hash({'class': type(corpus).__name__, 'files': files, 'options': options})
+
+def _file_digest(path, chunk_size=1<<24):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+def _hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()[:20]
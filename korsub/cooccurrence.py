@@ -0,0 +1,477 @@
+from array import array
+import os
+import shutil
+import tempfile
+import zipfile
+import numpy as np
+from .utils import frequency_ordered_csr
+from .utils import read_vocab
+from .utils import write_vocab
+
+
+# maximum number of runs merged at once
+_MERGE_FANIN = 16
+
+class CooccurrenceCounter:
+    """
+    Arguments
+    ---------
+    buffer_size : int
+        Number of (row, column) pairs kept in the append buffer.
+        When the buffer is full, the pairs are sorted and reduced into
+        the (key, count) arrays. Default is 1000000
+    max_memory : float or None
+        Memory budget (MB) of the (key, count) arrays and the buffer.
+        If it is set, the sorted arrays are written to a compressed run file
+        whenever they reach the budget and the runs are merged when the counts
+        are accessed, so the counts are exact without pruning. The memory of
+        interned rows and columns is not included. Default is None
+    spill_dir : str or None
+        Directory of the run files. A temporary directory is made in it and
+        removed after merging. Default is None, the system temporary directory
+
+    Usage
+    -----
+        counter = CooccurrenceCounter()
+        counter.add_features('컬렉션', [('이라는', 1), ('이라는이름', 1)])
+        counter.prune(min_count=2)
+
+        C = counter.to_dict()                   # same format with nested dict
+        X, idx_to_row, idx_to_col = counter.to_csr()   # same as c_to_x(C)
+
+        # exact counting with 1 GB of count arrays
+        counter = CooccurrenceCounter(max_memory=1024, spill_dir='/local/tmp')
+
+    Description
+    -----------
+    Rows and columns are interned to int ids and each co-occurrence is stored
+    as an int64 key (row_id << 32 | col_id). The pairs are appended to
+    a compact buffer and periodically sort-and-reduced into sorted key /
+    count arrays, so each distinct pair costs 16 bytes instead of the
+    hundreds of bytes of nested defaultdict entries.
+
+    Sorted arrays are kept as tiers like a log-structured merge tree.
+    A flushed buffer becomes the smallest tier and two last tiers are merged
+    while the former is at most twice of the latter, so each pair is merged
+    O(log N) times instead of copying all counts at every flush.
+
+    With max_memory, runs are merged block by block in a k-way merge. The
+    merge holds one block of each run and applies min_count of prune() or
+    to_csr() before the merged counts are kept in memory. When there are
+    more than 16 runs, groups of runs are first merged into larger runs on
+    disk, and the block size is bounded by max_memory, so the merge itself
+    stays within the budget.
+    """
+
+    def __init__(self, buffer_size=1000000, max_memory=None, spill_dir=None,
+        merge_block_size=1000000):
+        if max_memory:
+            # buffer is sorted with copies. keep it a quarter of the budget
+            buffer_size = max(1, min(buffer_size, int(max_memory * 1024 ** 2 / 32)))
+            # a merge holds a block of each run and their concatenated copies
+            merge_block_size = min(merge_block_size, max(4096,
+                int(max_memory * 1024 ** 2 / (64 * (_MERGE_FANIN + 1)))))
+        self.buffer_size = buffer_size
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.merge_block_size = merge_block_size
+        self.idx_to_row = []
+        self.row_to_idx = {}
+        self.idx_to_col = []
+        self.col_to_idx = {}
+        self._buffer = array('q')
+        # sorted unique (keys, counts) arrays, larger first
+        self._tiers = []
+        self._runs = []
+        self._run_dir = None
+        self._n_run_files = 0
+
+    def _row_id(self, row):
+        i = self.row_to_idx.get(row, -1)
+        if i == -1:
+            i = len(self.idx_to_row)
+            self.row_to_idx[row] = i
+            self.idx_to_row.append(row)
+        return i
+
+    def _col_id(self, col):
+        j = self.col_to_idx.get(col, -1)
+        if j == -1:
+            j = len(self.idx_to_col)
+            self.col_to_idx[col] = j
+            self.idx_to_col.append(col)
+        return j
+
+    def add(self, row, col):
+        self._buffer.append((self._row_id(row) << 32) | self._col_id(col))
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def add_features(self, row, cols):
+        base = self._row_id(row) << 32
+        col_id = self._col_id
+        append = self._buffer.append
+        for col in cols:
+            append(base | col_id(col))
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self, keys=None, counts=None):
+        # keys and counts are sorted unique arrays
+        if keys is None:
+            if not self._buffer:
+                return
+            keys = np.frombuffer(self._buffer, dtype=np.int64)
+            keys, counts = np.unique(keys, return_counts=True)
+            self._buffer = array('q')
+        if keys.shape[0] == 0:
+            return
+        tiers = self._tiers
+        tiers.append((keys, np.asarray(counts, dtype=np.int64)))
+        while len(tiers) > 1 and tiers[-2][0].shape[0] <= 2 * tiers[-1][0].shape[0]:
+            k2, c2 = tiers.pop()
+            k1, c1 = tiers.pop()
+            tiers.append(_merge_two(k1, c1, k2, c2))
+        # merging copies the arrays. spill at half of the budget
+        if self.max_memory and (self._nbytes() + self.buffer_size * 8) * 2 > self.max_memory * 1024 ** 2:
+            self._spill()
+
+    def _nbytes(self):
+        return sum(k.nbytes + c.nbytes for k, c in self._tiers)
+
+    def _arrays(self):
+        # It returns all in-memory counts as one sorted unique (keys, counts)
+        self._flush()
+        tiers = self._tiers
+        while len(tiers) > 1:
+            k2, c2 = tiers.pop()
+            k1, c1 = tiers.pop()
+            tiers.append(_merge_two(k1, c1, k2, c2))
+        if not tiers:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return tiers[0]
+
+    def _spill(self):
+        keys, counts = self._arrays()
+        if keys.shape[0] == 0:
+            return
+        path = self._run_path()
+        _write_run(path, [(keys, counts)], self.merge_block_size)
+        self._runs.append(path)
+        self._tiers = []
+
+    def _run_path(self):
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix='korsub-counts-', dir=self.spill_dir)
+        self._n_run_files += 1
+        return '{}/run_{:05}.npz'.format(self._run_dir, self._n_run_files - 1)
+
+    def _reduce_runs(self):
+        # merge groups of runs on disk until at most _MERGE_FANIN runs remain
+        while len(self._runs) > _MERGE_FANIN:
+            runs = []
+            for begin in range(0, len(self._runs), _MERGE_FANIN):
+                group = self._runs[begin:begin+_MERGE_FANIN]
+                if len(group) > 1:
+                    path = self._run_path()
+                    merged = _iter_merge_sources([_iter_run(p) for p in group], 1)
+                    _write_run(path, merged, self.merge_block_size)
+                    for p in group:
+                        os.remove(p)
+                    group = [path]
+                runs += group
+            self._runs = runs
+
+    def export_runs(self):
+        """
+        Spill the buffer and in-memory counts, and hand the run files over
+        to the caller. The counter becomes empty and does not remove the files.
+
+        Returns
+        -------
+        run_dir : str or None
+            Directory of the run files. It is removed by update_runs
+        paths : list of str
+            Run files. Their ids are of idx_to_row and idx_to_col
+        idx_to_row, idx_to_col : list
+        """
+        self._spill()
+        exported = (self._run_dir, self._runs, self.idx_to_row, self.idx_to_col)
+        self._runs = []
+        self._run_dir = None
+        return exported
+
+    def update_runs(self, run_dir, paths, idx_to_row, idx_to_col):
+        """
+        Add the counts of run files exported by export_runs, for example by
+        worker processes, and remove them. The runs are read block by block,
+        so only the counts of this counter are kept in memory under max_memory
+        """
+        try:
+            row_map = np.asarray([self._row_id(r) for r in idx_to_row], dtype=np.int64)
+            col_map = np.asarray([self._col_id(c) for c in idx_to_col], dtype=np.int64)
+            self._flush()
+            for path in paths:
+                for keys, counts in _iter_run(path):
+                    keys = (row_map[keys >> 32] << 32) | col_map[keys & 0xFFFFFFFF]
+                    order = np.argsort(keys)
+                    self._flush(keys[order], counts[order])
+        finally:
+            if run_dir is not None:
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+    @property
+    def n_runs(self):
+        """Number of run files written to disk and not merged yet"""
+        return len(self._runs)
+
+    def _consolidate(self, min_count=1):
+        # merge the buffer, tiers and all runs into one sorted (keys, counts)
+        keys, counts = self._arrays()
+        if not self._runs:
+            return keys, counts
+        self._reduce_runs()
+        sources = [_iter_run(path) for path in self._runs]
+        sources.append(_iter_blocks(keys, counts, self.merge_block_size))
+        self._tiers = []
+        keys, counts = _merge_sources(sources, min_count)
+        self._tiers = [(keys, counts)] if keys.shape[0] > 0 else []
+        self._cleanup()
+        return keys, counts
+
+    def _iter_merged(self):
+        # sorted unique (keys, counts) blocks of all counts. runs are kept
+        keys, counts = self._arrays()
+        if not self._runs:
+            return _iter_blocks(keys, counts, self.merge_block_size)
+        self._reduce_runs()
+        sources = [_iter_run(path) for path in self._runs]
+        sources.append(_iter_blocks(keys, counts, self.merge_block_size))
+        return _iter_merge_sources(sources, 1)
+
+    def _cleanup(self):
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+        self._runs = []
+        self._run_dir = None
+
+    def __del__(self):
+        # remove run files of counters which are not merged
+        if getattr(self, '_run_dir', None) is not None:
+            self._cleanup()
+
+    def __getstate__(self):
+        self._consolidate()
+        return self.__dict__.copy()
+
+    def update(self, other):
+        """Add the counts of other CooccurrenceCounter"""
+        other_keys, other_counts = other._consolidate()
+        if other_keys.shape[0] == 0:
+            return
+        row_map = np.asarray([self._row_id(r) for r in other.idx_to_row], dtype=np.int64)
+        col_map = np.asarray([self._col_id(c) for c in other.idx_to_col], dtype=np.int64)
+        rows = row_map[other_keys >> 32]
+        cols = col_map[other_keys & 0xFFFFFFFF]
+        keys = (rows << 32) | cols
+        order = np.argsort(keys)
+        self._flush()
+        self._flush(keys[order], other_counts[order])
+
+    def relabel(self, row_mapper=None, col_mapper=None):
+        """
+        It returns new CooccurrenceCounter of which rows are row_mapper(row)
+        and columns are col_mapper(column). Pairs of which row or column is
+        mapped to None are removed, and counts of pairs mapped to same
+        (row, column) are summed
+        """
+        other = CooccurrenceCounter(self.buffer_size, self.max_memory,
+            self.spill_dir, self.merge_block_size)
+
+        def to_ids(values, mapper, intern):
+            ids = np.full(len(values), -1, dtype=np.int64)
+            for i, value in enumerate(values):
+                value = value if mapper is None else mapper(value)
+                if value is not None:
+                    ids[i] = intern(value)
+            return ids
+
+        row_ids = to_ids(self.idx_to_row, row_mapper, other._row_id)
+        col_ids = to_ids(self.idx_to_col, col_mapper, other._col_id)
+        # spilled runs are merged, filtered and mapped block by block, so
+        # removed pairs are not loaded at once. other spills under max_memory
+        for self_keys, self_counts in self._iter_merged():
+            rows = row_ids[self_keys >> 32]
+            cols = col_ids[self_keys & 0xFFFFFFFF]
+            valid = (rows >= 0) & (cols >= 0)
+            keys = (rows[valid] << 32) | cols[valid]
+            counts = self_counts[valid]
+            order = np.argsort(keys, kind='stable')
+            other._flush(*_sum_sorted(keys[order], counts[order]))
+        return other
+
+    def prune(self, min_count):
+        """Remove (row, column) pairs of which count is smaller than min_count"""
+        keys, counts = self._consolidate(min_count)
+        mask = counts >= min_count
+        self._tiers = [(keys[mask], counts[mask])]
+
+    @property
+    def nnz(self):
+        return self._consolidate()[0].shape[0]
+
+    def __len__(self):
+        keys, _ = self._consolidate()
+        return np.unique(keys >> 32).shape[0]
+
+    def items(self):
+        """It yields (row, dict of {column: count}) like nested dict"""
+        keys, counts = self._consolidate()
+        rows = keys >> 32
+        cols = (keys & 0xFFFFFFFF).tolist()
+        counts = counts.tolist()
+        bounds = np.flatnonzero(np.diff(rows)) + 1
+        bounds = [0] + bounds.tolist() + [rows.shape[0]]
+        idx_to_col = self.idx_to_col
+        for b, e in zip(bounds, bounds[1:]):
+            if b == e:
+                continue
+            d = {idx_to_col[cols[k]]:counts[k] for k in range(b, e)}
+            yield self.idx_to_row[int(rows[b])], d
+
+    def to_dict(self, min_count=1):
+        """
+        Returns
+        -------
+        C : dict of dict
+            C[row][column] = count
+        """
+        if min_count > 1:
+            self.prune(min_count)
+        return dict(self.items())
+
+    def save(self, path):
+        """
+        Save counter to directory path as rows.npy, cols.npy, counts.npy
+        (sorted by (row, column)) and idx_to_row.jsonl, idx_to_col.jsonl
+        """
+        keys, counts = self._consolidate()
+        os.makedirs(path, exist_ok=True)
+        np.save('{}/rows.npy'.format(path), (keys >> 32).astype(np.int32))
+        np.save('{}/cols.npy'.format(path), (keys & 0xFFFFFFFF).astype(np.int32))
+        np.save('{}/counts.npy'.format(path), counts)
+        write_vocab('{}/idx_to_row.jsonl'.format(path), self.idx_to_row)
+        write_vocab('{}/idx_to_col.jsonl'.format(path), self.idx_to_col)
+
+    @classmethod
+    def load(cls, path, buffer_size=1000000):
+        """Load counter saved by save()"""
+        counter = cls(buffer_size)
+        counter.idx_to_row = read_vocab('{}/idx_to_row.jsonl'.format(path))
+        counter.idx_to_col = read_vocab('{}/idx_to_col.jsonl'.format(path))
+        counter.row_to_idx = {row:idx for idx, row in enumerate(counter.idx_to_row)}
+        counter.col_to_idx = {col:idx for idx, col in enumerate(counter.idx_to_col)}
+        rows = np.load('{}/rows.npy'.format(path)).astype(np.int64)
+        cols = np.load('{}/cols.npy'.format(path)).astype(np.int64)
+        counts = np.load('{}/counts.npy'.format(path)).astype(np.int64)
+        counter._flush((rows << 32) | cols, counts)
+        return counter
+
+    def to_csr(self, min_count=1, dtype=np.int64):
+        """
+        Returns
+        -------
+        X : scipy.sparse.csr_matrix
+            (row, column) count matrix. Rows and columns are sorted by
+            their frequency in decreasing order, same with c_to_x
+        idx_to_row : list
+            Mapper from index to row value
+        idx_to_col : list
+            Mapper from index to column value
+        """
+        if min_count > 1:
+            self.prune(min_count)
+        keys, counts = self._consolidate()
+        return frequency_ordered_csr(keys >> 32, keys & 0xFFFFFFFF,
+            counts.astype(dtype), self.idx_to_row, self.idx_to_col)
+
+
+def _sum_sorted(keys, counts):
+    # sum counts of duplicated keys of sorted keys
+    if keys.shape[0] > 1:
+        starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+        if starts.shape[0] < keys.shape[0]:
+            counts = np.add.reduceat(counts, starts)
+            keys = keys[starts]
+    return keys, counts
+
+def _merge_two(k1, c1, k2, c2):
+    # stable sort of two concatenated sorted arrays is a linear merge (timsort)
+    keys = np.concatenate([k1, k2])
+    counts = np.concatenate([c1, c2])
+    order = np.argsort(keys, kind='stable')
+    return _sum_sorted(keys[order], counts[order])
+
+def _write_run(path, blocks, block_size):
+    # blocks are written one by one, so a merged run is not loaded at once
+    n_blocks = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as f:
+        for keys, counts in blocks:
+            for begin in range(0, keys.shape[0], block_size):
+                # sorted keys are stored as differences, which are compressed well
+                _write_array(f, 'keys_{}'.format(n_blocks),
+                    np.diff(keys[begin:begin+block_size], prepend=0))
+                _write_array(f, 'counts_{}'.format(n_blocks), counts[begin:begin+block_size])
+                n_blocks += 1
+        _write_array(f, 'n_blocks', np.asarray(n_blocks))
+
+def _write_array(f, name, arr):
+    # same member format with np.savez
+    with f.open('{}.npy'.format(name), 'w', force_zip64=True) as member:
+        np.lib.format.write_array(member, arr, allow_pickle=False)
+
+def _iter_run(path):
+    with np.load(path) as f:
+        for i in range(int(f['n_blocks'])):
+            keys = np.cumsum(f['keys_{}'.format(i)])
+            yield keys, f['counts_{}'.format(i)]
+
+def _iter_blocks(keys, counts, block_size):
+    for begin in range(0, keys.shape[0], block_size):
+        yield keys[begin:begin+block_size], counts[begin:begin+block_size]
+
+def _merge_sources(sources, min_count):
+    merged_keys, merged_counts = [], []
+    for keys, counts in _iter_merge_sources(sources, min_count):
+        merged_keys.append(keys)
+        merged_counts.append(counts)
+    if not merged_keys:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(merged_keys), np.concatenate(merged_counts).astype(np.int64)
+
+def _iter_merge_sources(sources, min_count):
+    """
+    k-way merge of sorted unique (key, count) block iterators.
+    At each step, the keys up to the smallest last key of the current blocks
+    are taken from every block, so each merged key is complete
+    """
+
+    heads = [next(source, None) for source in sources]
+    while True:
+        active = [i for i, head in enumerate(heads) if head is not None]
+        if not active:
+            break
+        threshold = min(heads[i][0][-1] for i in active)
+        keys, counts = [], []
+        for i in active:
+            k, c = heads[i]
+            n = np.searchsorted(k, threshold, side='right')
+            keys.append(k[:n])
+            counts.append(c[:n])
+            heads[i] = (k[n:], c[n:]) if n < k.shape[0] else next(sources[i], None)
+        keys = np.concatenate(keys)
+        counts = np.concatenate(counts)
+        order = np.argsort(keys, kind='stable')
+        keys, counts = _sum_sorted(keys[order], counts[order])
+        mask = counts >= min_count
+        yield keys[mask], counts[mask]
@@ -1,9 +1,22 @@
+from collections import defaultdict
+from itertools import repeat
+import json
+import os
+import numpy as np
+from .math import train_pmi
+from .similarity import SimilarityIndex
 from .tagged_corpus.train import train_lr2vec
+from .tagged_corpus.vectorizer import hash_feature
+from .tagged_corpus.vectorizer import lr_sents_to_features
+from .utils import load_csr
+from .utils import read_vocab
+from .utils import save_csr
+from .utils import write_vocab
 
 class LR2Vec:
     def __init__(self, lr_corpus=None, vocab_min_count=20, feature_min_count=5,
         min_cooccurrence=2, beta=0.75, min_pmi=0.0, dim=300,
-        prune_per_sent=1000000, verbose=True):
+        prune_per_sent=1000000, verbose=True, n_hash_features=None):
 
         self._vocab_min_count = vocab_min_count
         self._feature_min_count = feature_min_count
@@ -12,19 +25,34 @@ class LR2Vec:
         self._min_pmi = min_pmi
         self._dim = dim
         self._prune_per_sent = prune_per_sent
+        self._n_hash_features = n_hash_features
         self.verbose = verbose
+        self.index = None
+        # subwords of scan_subwords. neighbors are checked with them in infer_corpus
+        self.idx_to_sub = None
 
         if lr_corpus is not None:
             self.train(lr_corpus, self._vocab_min_count,
                 self._feature_min_count, self._min_cooccurrence,
                 self._prune_per_sent, self._min_pmi, self._beta,
-                self._dim, self.verbose)
+                self._dim, self.verbose, self._n_hash_features)
 
     def train(self, lr_corpus, vocab_min_count=10, feature_min_count=5,
         min_cooccurrence=2, prune_per_sent=100000, min_pmi=0,
-        beta=0.75, n_components=300, verbose=True):
+        beta=0.75, n_components=300, verbose=True, n_hash_features=None):
 
-        returns = train_lr2vec(lr_corpus)
+        self._vocab_min_count = vocab_min_count
+        self._feature_min_count = feature_min_count
+        self._min_cooccurrence = min_cooccurrence
+        self._beta = beta
+        self._min_pmi = min_pmi
+        self._dim = n_components
+        self._prune_per_sent = prune_per_sent
+        # with n_hash_features, idx_to_col is list of hash buckets
+        self._n_hash_features = n_hash_features
+        returns = train_lr2vec(lr_corpus, vocab_min_count, feature_min_count,
+            min_cooccurrence, prune_per_sent, min_pmi, beta, n_components,
+            verbose, n_hash_features=n_hash_features)
 
         self.X = returns[0]
         self.idx_to_row = returns[1]
@@ -33,6 +61,347 @@ class LR2Vec:
         self.py = returns[4]
         self.wv = returns[5]
         self.mapper = returns[6]
+        self.idx_to_sub = returns[7]
+        self.index = None
+        self._col_to_idx = None
 
         if self.verbose:
             print('Train was done.')
+
+    def save(self, path):
+        """
+        :param path: str
+            Directory path. Arrays are saved as .npy files, sparse matrices as
+            their data / indices / indptr arrays, and idx_to_row, idx_to_col
+            and idx_to_sub as json lines. The files can be loaded with mmap_mode.
+        """
+
+        os.makedirs(path, exist_ok=True)
+        for name in ['wv', 'mapper', 'py']:
+            np.save('{}/{}.npy'.format(path, name), np.asarray(getattr(self, name)))
+        save_csr(path, 'X', self.X)
+        save_csr(path, 'pmi', self.pmi)
+        write_vocab('{}/idx_to_row.jsonl'.format(path), self.idx_to_row)
+        write_vocab('{}/idx_to_col.jsonl'.format(path), self.idx_to_col)
+        if self.idx_to_sub is not None:
+            write_vocab('{}/idx_to_sub.jsonl'.format(path), self.idx_to_sub)
+        params = {
+            'vocab_min_count': self._vocab_min_count,
+            'feature_min_count': self._feature_min_count,
+            'min_cooccurrence': self._min_cooccurrence,
+            'beta': self._beta,
+            'min_pmi': self._min_pmi,
+            'dim': self._dim,
+            'prune_per_sent': self._prune_per_sent,
+            'n_hash_features': self._n_hash_features
+        }
+        with open('{}/params.json'.format(path), 'w', encoding='utf-8') as f:
+            json.dump(params, f, indent=2)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None, verbose=False):
+        """
+        :param path: str
+            Directory path saved by LR2Vec.save
+        :param mmap_mode: str or None
+            If 'r', arrays and sparse matrices are memory-mapped, so processes
+            loading same model share one page-cached copy. Default is None
+        It returns
+        ----------
+        LR2Vec
+        """
+
+        with open('{}/params.json'.format(path), encoding='utf-8') as f:
+            params = json.load(f)
+        model = cls(verbose=verbose, **params)
+        for name in ['wv', 'mapper', 'py']:
+            setattr(model, name, np.load('{}/{}.npy'.format(path, name), mmap_mode=mmap_mode))
+        model.X = load_csr(path, 'X', mmap_mode)
+        model.pmi = load_csr(path, 'pmi', mmap_mode)
+        model.idx_to_row = read_vocab('{}/idx_to_row.jsonl'.format(path))
+        model.idx_to_col = read_vocab('{}/idx_to_col.jsonl'.format(path))
+        sub_path = '{}/idx_to_sub.jsonl'.format(path)
+        if os.path.exists(sub_path):
+            model.idx_to_sub = read_vocab(sub_path)
+        return model
+
+    def build_index(self, method='exact', **kwargs):
+        """
+        :param method: str
+            'exact' or 'lsh'. See korsub.similarity.SimilarityIndex
+        It returns
+        ----------
+        index : SimilarityIndex
+            Index of self.wv with self.idx_to_row. It is also stored as self.index
+        """
+
+        self.index = SimilarityIndex(self.wv, self.idx_to_row, method=method, **kwargs)
+        return self.index
+
+    def most_similar(self, query, topk=10):
+        """
+        :param query: tuple
+            (subword, 'L' or 'R'). For example ('컬렉션', 'L')
+        :param topk: int
+            Maximum number of similar subwords
+        It returns
+        ----------
+        similars : list of tuple
+            List contains tuples ((subword, 'L' or 'R'), cosine similarity)
+        """
+
+        if self.index is None:
+            self.build_index()
+        return self.index.most_similar(query, topk)
+
+    def most_similar_batch(self, queries, topk=10, block_size=None, n_jobs=1,
+        as_vocab=False, block_memory=256):
+        """
+        :param queries: list of tuple
+            List of (subword, 'L' or 'R')
+        :param topk: int
+            Number of similar subwords of each query
+        :param block_size: int or None
+            Number of queries multiplied at once. If None, it is derived from
+            block_memory. Default is None
+        :param n_jobs: int
+            Number of threads. Default is 1
+        :param as_vocab: Boolean
+            If True, it maps indices through idx_to_row and returns list of
+            list of ((subword, 'L' or 'R'), cosine similarity)
+        :param block_memory: float
+            Memory (MB) of a block of each thread. Default is 256
+        It returns
+        ----------
+        idxs : numpy.ndarray
+            int64, shape = (n_queries, topk). Padded with -1 for unknown query
+        scores : numpy.ndarray
+            shape = (n_queries, topk). Padded with nan for unknown query
+        """
+
+        if self.index is None:
+            self.build_index()
+        idxs, scores = self.index.most_similar_batch(queries, topk, block_size,
+            n_jobs, block_memory)
+        if not as_vocab:
+            return idxs, scores
+        return [[(self.idx_to_row[i], s) for i, s in zip(row_idxs, row_scores) if i >= 0]
+                for row_idxs, row_scores in zip(idxs.tolist(), scores.tolist())]
+
+    def infer(self, word_and_features, batch_size=10000):
+        """
+        :param word_and_features: list of tuple
+            List of (word, features), the output of lr_sents_to_features.
+            The features of same word are summed
+        :param batch_size: int
+            Number of words transformed at once
+        It returns
+        ----------
+        words : list
+            List of (subword, 'L' or 'R')
+        vectors : numpy.ndarray
+            shape = (n_words, dim). Words without known features have zero vector
+
+        The counts of features are transformed to PPMI with the trained py and
+        projected with mapper, without re-training SVD.
+            wv(word) = ppmi(word) x VT.T x Sigma^-0.5
+        """
+
+        col_idx = self._get_col_idx()
+        C = defaultdict(lambda: defaultdict(int))
+        for word, features in word_and_features:
+            Cw = C[word]
+            for feature in features:
+                j = col_idx(feature)
+                if j >= 0:
+                    Cw[j] += 1
+        return self._fold_in(C, batch_size)
+
+    def infer_corpus(self, lr_corpus, words=None, min_count=1, batch_size=10000):
+        """
+        :param lr_corpus: iterable of list of (L, R) tuples
+            For example, FourColumnLRCorpusDecorator
+        :param words: set of tuple or None
+            Words to be inferred, for example {('컬렉션', 'L')}.
+            If None, it infers all words not in idx_to_row
+        :param min_count: int
+            Minimum number of feature occurrence of inferred word
+        :param batch_size: int
+            Number of words transformed at once
+        It returns
+        ----------
+        words : list
+            List of (subword, 'L' or 'R')
+        vectors : numpy.ndarray
+            shape = (n_words, dim)
+
+        Features are counted in one streaming pass over lr_corpus, in the same
+        way as train_lr2vec: the neighbor subwords are checked with the
+        subwords of scan_subwords (idx_to_sub), and (word, feature) pairs of
+        which count is smaller than min_cooccurrence are removed before PPMI.
+        So a word of the training corpus gets back its row of wv, when the
+        counts were not pruned in training. Models saved without idx_to_sub
+        check the neighbors with the subwords of idx_to_row.
+        """
+
+        self._check_lr_rows()
+        col_idx = self._get_col_idx()
+        row_to_idx = {row:idx for idx, row in enumerate(self.idx_to_row)}
+        if self.idx_to_sub is not None:
+            sub_dic = set(self.idx_to_sub)
+        else:
+            sub_dic = {sub for sub, _ in self.idx_to_row}
+        C = defaultdict(lambda: defaultdict(int))
+        for lrs in lr_corpus:
+            word_and_features = lr_sents_to_features(lrs, sub_dic, sub_dic, check=True)
+            for word, features in word_and_features:
+                if words is None:
+                    if word in row_to_idx:
+                        continue
+                elif not (word in words):
+                    continue
+                Cw = C[word]
+                for feature in features:
+                    j = col_idx(feature)
+                    if j >= 0:
+                        Cw[j] += 1
+        min_cooccurrence = self._min_cooccurrence
+        C = {w:{j:v for j, v in d.items() if v >= min_cooccurrence} for w, d in C.items()}
+        C = {w:d for w, d in C.items() if d and sum(d.values()) >= min_count}
+        return self._fold_in(C, batch_size)
+
+    def transform_corpus(self, lr_corpus, block_size=100000, dtype=None):
+        """
+        :param lr_corpus: iterable of list of (L, R) tuples
+            For example, FourColumnLRCorpusDecorator or CompiledLRCorpus
+        :param block_size: int
+            Maximum number of eojeols of each block. A block contains whole
+            sentences. A sentence longer than block_size is yielded alone
+        :param dtype: numpy.dtype or None
+            Data type of vectors. Default is the dtype of wv
+        It yields
+        ---------
+        L : numpy.ndarray
+            shape = (n_eojeols, dim). Vectors of (L, 'L'). Zero if unknown
+        R : numpy.ndarray
+            shape = (n_eojeols, dim). Vectors of (R, 'R'). Zero if R is empty or unknown
+        offsets : numpy.ndarray
+            int64, shape = (n_sents + 1,). Eojeols of i-th sentence of the block
+            are L[offsets[i]:offsets[i+1]]. Empty sentences are kept
+
+        Usage
+        -----
+            for L, R, offsets in lr2vec.transform_corpus(lr_corpus):
+                features = np.hstack([L, R])
+
+        Row ids are looked up once per block with C-level map over dict.get,
+        or with an array from string id to row id for CompiledLRCorpus.
+        Vectors are gathered into two preallocated buffers, which are reused
+        for the next block. Copy L and R to keep them.
+        """
+
+        self._check_lr_rows()
+        wv = self.wv if dtype is None else np.asarray(self.wv, dtype=dtype)
+        l_to_idx, r_to_idx = {}, {}
+        for idx, (sub, direction) in enumerate(self.idx_to_row):
+            if direction == 'L':
+                l_to_idx[sub] = idx
+            else:
+                r_to_idx[sub] = idx
+
+        if hasattr(lr_corpus, 'idx_to_str') and hasattr(lr_corpus, 'offsets'):
+            blocks = _compiled_id_blocks(lr_corpus, l_to_idx, r_to_idx, block_size)
+        else:
+            blocks = _id_blocks(lr_corpus, l_to_idx, r_to_idx, block_size)
+
+        L_buf = np.empty((block_size, wv.shape[1]), dtype=wv.dtype)
+        R_buf = np.empty((block_size, wv.shape[1]), dtype=wv.dtype)
+        for l_ids, r_ids, offsets in blocks:
+            n = l_ids.shape[0]
+            if n > L_buf.shape[0]:
+                L_buf = np.empty((n, wv.shape[1]), dtype=wv.dtype)
+                R_buf = np.empty((n, wv.shape[1]), dtype=wv.dtype)
+            L, R = L_buf[:n], R_buf[:n]
+            # -1 (unknown) is clipped to row 0 and reset to zero
+            np.take(wv, l_ids, axis=0, out=L, mode='clip')
+            np.take(wv, r_ids, axis=0, out=R, mode='clip')
+            L[l_ids < 0] = 0
+            R[r_ids < 0] = 0
+            yield L, R, offsets
+
+    def _check_lr_rows(self):
+        # models of korsub.text_corpus.train_lr2vec have subword rows
+        if self.idx_to_row and not isinstance(self.idx_to_row[0], tuple):
+            raise ValueError("Rows must be (subword, 'L' or 'R') to read LR corpus; "
+                "got {}. Models trained on text corpus do not support it".format(self.idx_to_row[0]))
+
+    def _get_col_to_idx(self):
+        if getattr(self, '_col_to_idx', None) is None:
+            self._col_to_idx = {col:idx for idx, col in enumerate(self.idx_to_col)}
+        return self._col_to_idx
+
+    def _get_col_idx(self):
+        # It returns a function from feature to column index, -1 if unknown
+        col_to_idx = self._get_col_to_idx()
+        n_features = self._n_hash_features
+        if n_features:
+            return lambda feature: col_to_idx.get(hash_feature(feature, n_features), -1)
+        return lambda feature: col_to_idx.get(feature, -1)
+
+    def _fold_in(self, C, batch_size):
+        from scipy.sparse import csr_matrix
+
+        words = list(C)
+        n_cols = len(self.idx_to_col)
+        vectors = np.zeros((len(words), self.mapper.shape[1]), dtype=self.mapper.dtype)
+        for b in range(0, len(words), batch_size):
+            batch = words[b:b+batch_size]
+            rows, cols, data = [], [], []
+            for i, word in enumerate(batch):
+                for j, v in C[word].items():
+                    rows.append(i)
+                    cols.append(j)
+                    data.append(v)
+            if not data:
+                continue
+            X = csr_matrix((data, (rows, cols)), shape=(len(batch), n_cols))
+            pmi, _, _ = train_pmi(X, py=self.py, min_pmi=self._min_pmi)
+            vectors[b:b+len(batch)] = pmi.dot(self.mapper)
+        return words, vectors
+
+def _id_blocks(lr_corpus, l_to_idx, r_to_idx, block_size):
+    # It yields (l_ids, r_ids, offsets) of whole sentences. Unknown id is -1
+    def to_block(ls, rs, lens):
+        l_ids = np.fromiter(map(l_to_idx.get, ls, repeat(-1)), dtype=np.int64, count=len(ls))
+        r_ids = np.fromiter(map(r_to_idx.get, rs, repeat(-1)), dtype=np.int64, count=len(rs))
+        offsets = np.zeros(len(lens) + 1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        return l_ids, r_ids, offsets
+
+    ls, rs, lens = [], [], []
+    for lrs in lr_corpus:
+        if ls and len(ls) + len(lrs) > block_size:
+            yield to_block(ls, rs, lens)
+            ls, rs, lens = [], [], []
+        for l, r in lrs:
+            ls.append(l)
+            rs.append(r)
+        lens.append(len(lrs))
+    if lens:
+        yield to_block(ls, rs, lens)
+
+def _compiled_id_blocks(lr_corpus, l_to_idx, r_to_idx, block_size):
+    # string id of CompiledLRCorpus to row id, so no string is decoded
+    strings = lr_corpus.idx_to_str
+    l_map = np.fromiter(map(l_to_idx.get, strings, repeat(-1)), dtype=np.int64, count=len(strings))
+    r_map = np.fromiter(map(r_to_idx.get, strings, repeat(-1)), dtype=np.int64, count=len(strings))
+    offsets = np.asarray(lr_corpus.offsets)
+    n_sents = offsets.shape[0] - 1
+    bs = 0
+    while bs < n_sents:
+        base = offsets[bs]
+        es = int(np.searchsorted(offsets, base + block_size, side='right')) - 1
+        es = min(max(es, bs + 1), n_sents)
+        b, e = offsets[bs], offsets[es]
+        yield l_map[lr_corpus.l[b:e]], r_map[lr_corpus.r[b:e]], offsets[bs:es+1] - b
+        bs = es
@@ -0,0 +1,190 @@
+import json
+import logging
+import sys
+import time
+from .utils import get_process_memory
+
+
+class Instrument:
+    """
+    Base class of instrumentation sinks. It also works as the no-op sink.
+
+    Usage
+    -----
+        instrument = JsonLinesInstrument('train.jsonl')
+        train_lr2vec(lr_corpus, instrument=instrument)
+
+        # custom sink
+        class MySink(Instrument):
+            def emit(self, event):
+                print(event['stage'], event['event'], event['n_sents'])
+
+    Description
+    -----------
+    Counting functions create a Stage with instrument.stage(name) and report
+    'start', 'progress', 'prune' and 'end' events. Each event is a dict
+
+        {'stage': 'scan_features', 'event': 'progress', 'n_sents': 10000,
+         'elapsed': 1.2, 'sents_per_sec': 8333.3, 'rss_gb': 0.52,
+         'num_features': 123456}
+
+    When enabled is False, stage() returns a shared no-op Stage and
+    nothing is computed, so the no-op sink costs only a method call
+    at each progress point.
+    """
+
+    enabled = False
+    measure_memory = True
+
+    def stage(self, name, **info):
+        if not self.enabled:
+            return _NULL_STAGE
+        return Stage(self, name, info)
+
+    def emit(self, event):
+        pass
+
+
+class Stage:
+    def __init__(self, instrument, name, info):
+        self.instrument = instrument
+        self.name = name
+        self.begin = time.perf_counter()
+        self._emit('start', 0, info)
+
+    def _emit(self, event, n_sents, counts):
+        elapsed = time.perf_counter() - self.begin
+        record = {
+            'stage': self.name,
+            'event': event,
+            'n_sents': n_sents,
+            'elapsed': elapsed,
+            'sents_per_sec': n_sents / elapsed if elapsed > 0 else 0.0,
+        }
+        if self.instrument.measure_memory:
+            record['rss_gb'] = get_process_memory()
+        record.update(counts)
+        self.instrument.emit(record)
+
+    def progress(self, n_sents, **counts):
+        self._emit('progress', n_sents, counts)
+
+    def prune(self, n_sents, **counts):
+        self._emit('prune', n_sents, counts)
+
+    def end(self, n_sents, **counts):
+        self._emit('end', n_sents, counts)
+
+
+class _NullStage:
+    def progress(self, n_sents, **counts):
+        pass
+
+    def prune(self, n_sents, **counts):
+        pass
+
+    def end(self, n_sents, **counts):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+
+class PrintInstrument(Instrument):
+    """Prints one status line per stage to stdout. It is used with verbose=True"""
+
+    enabled = True
+
+    def emit(self, event):
+        if event['event'] == 'start':
+            return
+        counts = ', '.join('{} = {}'.format(k, v) for k, v in event.items()
+                           if not (k in _COMMON_KEYS))
+        message = '\r[{}] {} sents{}, {:.1f} sents/sec, mem = {:.3} GB{}'.format(
+            event['stage'], event['n_sents'], ', ' + counts if counts else '',
+            event['sents_per_sec'], event.get('rss_gb', 0.0), ' ' * 5)
+        if event['event'] == 'end':
+            print(message + ' done')
+        else:
+            print(message, end='')
+            sys.stdout.flush()
+
+
+class LoggingInstrument(Instrument):
+    """
+    Arguments
+    ---------
+    logger : logging.Logger or None
+        Default is logging.getLogger('korsub')
+    level : int
+        Log level of events. Default is logging.INFO
+    """
+
+    enabled = True
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger if logger is not None else logging.getLogger('korsub')
+        self.level = level
+
+    def emit(self, event):
+        self.logger.log(self.level, '%s', json.dumps(event, ensure_ascii=False))
+
+
+class JsonLinesInstrument(Instrument):
+    """
+    Arguments
+    ---------
+    path_or_file : str or file object
+        Events are appended one json per line
+    """
+
+    enabled = True
+
+    def __init__(self, path_or_file):
+        if isinstance(path_or_file, str):
+            self._file = open(path_or_file, 'a', encoding='utf-8')
+            self._own = True
+        else:
+            self._file = path_or_file
+            self._own = False
+
+    def emit(self, event):
+        self._file.write('{}\n'.format(json.dumps(event, ensure_ascii=False)))
+        self._file.flush()
+
+    def close(self):
+        if self._own:
+            self._file.close()
+
+
+class CallbackInstrument(Instrument):
+    """
+    Arguments
+    ---------
+    callback : callable
+        It is called with each event dict
+    measure_memory : Boolean
+        If False, rss_gb is not measured. Default is True
+    """
+
+    enabled = True
+
+    def __init__(self, callback, measure_memory=True):
+        self.callback = callback
+        self.measure_memory = measure_memory
+
+    def emit(self, event):
+        self.callback(event)
+
+
+_COMMON_KEYS = {'stage', 'event', 'n_sents', 'elapsed', 'sents_per_sec', 'rss_gb'}
+_NULL_INSTRUMENT = Instrument()
+
+def get_instrument(instrument=None, verbose=False):
+    """
+    It returns instrument if it is given. Else, PrintInstrument if verbose
+    is True, or the no-op Instrument
+    """
+
+    if instrument is not None:
+        return instrument
+    return PrintInstrument() if verbose else _NULL_INSTRUMENT
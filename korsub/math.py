@@ -1,26 +1,9 @@
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import math
-from scipy.sparse import diags
-from sklearn.metrics import pairwise_distances
-from sklearn.utils import check_random_state
-from sklearn.utils.extmath import randomized_svd
-from sklearn.utils.extmath import safe_sparse_dot
-
-def _as_diag(px, alpha):
-    px_diag = diags(px.tolist()[0])
-    px_diag.data[0] = np.asarray([0 if v == 0 else 1 / (v + alpha) for v in px_diag.data[0]])
-    return px_diag
-
-def _logarithm_and_ppmi(exp_pmi, min_exp_pmi):
-    # because exp_pmi is sparse matrix and type of exp_pmi.data is numpy.ndarray
-    indices = np.where(exp_pmi.data < min_exp_pmi)[0]
-    exp_pmi.data[indices] = 1
-
-    # apply logarithm
-    exp_pmi.data = np.log(exp_pmi.data)
-    return exp_pmi
-
-def train_pmi(X, py=None, min_pmi=0, alpha=0.0, beta=1):
+
+def train_pmi(X, py=None, min_pmi=0, alpha=0.0, beta=1, dtype=np.float64,
+    block_size=100000, n_jobs=1):
     """
     :param X: scipy.sparse.csr_matrix
         (word, contexts) sparse matrix
@@ -36,41 +19,78 @@ def train_pmi(X, py=None, min_pmi=0, alpha=0.0, beta=1):
     :param beta: float
         Smoothing factor. pmi(x,y) = log ( Pxy / (Px x Py^beta) )
         Default is 1.0
+    :param dtype: numpy.dtype
+        Data type of pmi matrix. Default is numpy.float64
+    :param block_size: int
+        Number of rows transformed at once. Default is 100000
+    :param n_jobs: int
+        Number of threads used to transform row blocks. Default is 1
     It returns
     ----------
-    pmi : scipy.sparse.dok_matrix or scipy.sparse.csr_matrix
+    pmi : scipy.sparse.csr_matrix
         (word, contexts) pmi value sparse matrix
     px : numpy.ndarray
         Probability of rows (items)
     py : numpy.ndarray
         Probability of columns (features)
+
+    The pmi values are computed directly on a copy of X.data with indptr and
+    indices, so the peak memory is about one copy of X.
     """
 
+    from scipy.sparse import csr_matrix
+
     assert 0 < beta <= 1
 
-    # convert x to probability matrix & marginal probability 
-    px = np.asarray((X.sum(axis=1) / X.sum()).reshape(-1))
+    X = csr_matrix(X)
+    n_rows, n_cols = X.shape
+
+    # convert x to probability matrix & marginal probability
+    total = X.data.sum(dtype=np.float64)
+    row_sum = np.asarray(X.sum(axis=1), dtype=np.float64).reshape(-1)
+    px = row_sum / total
     if py is None:
-        py = np.asarray((X.sum(axis=0) / X.sum()).reshape(-1))
+        col_sum = np.bincount(X.indices, weights=X.data, minlength=n_cols)
+        py = col_sum / total
+    py = np.asarray(py, dtype=np.float64).reshape(-1)
     if beta < 1:
         py = py ** beta
         py /= py.sum()
-    pxy = X / X.sum()
 
-    # transform px and py to diagonal matrix
-    # using scipy.sparse.diags
     # pmi_alpha (x,y) = p(x,y) / ( p(x) x (p(y) + alpha) )
-    px_diag = _as_diag(px, 0)
-    py_diag = _as_diag(py, alpha)
-    exp_pmi = px_diag.dot(pxy).dot(py_diag)
+    #                 = X(x,y) / ( sum_y X(x,y) ) / (p(y) + alpha)
+    with np.errstate(divide='ignore'):
+        inv_rx = np.where(row_sum == 0, 0, 1 / row_sum)
+        inv_py = np.where(py == 0, 0, 1 / (py + alpha))
 
     # PPMI using threshold
     min_exp_pmi = 1 if min_pmi == 0 else np.exp(min_pmi)
-    pmi = _logarithm_and_ppmi(exp_pmi, min_exp_pmi)
 
-    return pmi, px, py
+    data = np.empty(X.data.shape[0], dtype=dtype)
+    indptr, indices = X.indptr, X.indices
+
+    def transform(b):
+        e = min(b + block_size, n_rows)
+        s, t = indptr[b], indptr[e]
+        block = data[s:t]
+        np.multiply(X.data[s:t], inv_py[indices[s:t]], out=block)
+        block *= np.repeat(inv_rx[b:e], np.diff(indptr[b:e+1]))
+        block[block < min_exp_pmi] = 1
+        np.log(block, out=block)
 
-def train_svd(X, n_components, n_iter=5, random_state=None):
+    blocks = range(0, n_rows, block_size)
+    if n_jobs > 1:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            list(executor.map(transform, blocks))
+    else:
+        for b in blocks:
+            transform(b)
+
+    pmi = csr_matrix((data, indices.copy(), indptr.copy()), shape=X.shape)
+    return pmi, px.reshape(1, -1), py.reshape(1, -1)
+
+def train_svd(X, n_components, n_iter=5, random_state=None, backend='randomized',
+    dtype=np.float64, n_oversamples=10, block_size=100000, max_memory=None):
     """
     :param X: scipy.sparse.csr_matrix
         Input matrix
@@ -80,6 +100,25 @@ def train_svd(X, n_components, n_iter=5, random_state=None):
         Maximum number of iteration. Default is 5
     :param random_state: random state
         Default is None
+    :param backend: str
+        'randomized' uses sklearn randomized_svd on X converted to dtype.
+        'arpack' uses scipy.sparse.linalg.svds, which is exact but slower.
+        'blocked' is out-of-core randomized SVD. It streams row blocks of X,
+        so X can be memory-mapped (korsub.utils.load_csr), and keeps only
+        (n_cols, n_components + n_oversamples) matrices besides U.
+        'auto' chooses 'randomized' if it fits in max_memory, else 'blocked'.
+        Default is 'randomized'
+    :param dtype: numpy.dtype
+        Data type of computation and outputs. numpy.float32 halves the memory
+        of the random projections and U. Default is numpy.float64
+    :param n_oversamples: int
+        Number of additional random vectors of randomized backends. Default is 10
+    :param block_size: int
+        Number of rows of X multiplied at once in 'blocked' backend. Default is 100000
+    :param max_memory: float or None
+        Memory budget in MB. The memory is estimated with estimate_svd_memory
+        before computing. If the estimate exceeds the budget, 'blocked' backend
+        reduces block_size and the other backends raise ValueError
     It returns
     ----------
     U : numpy.ndarray
@@ -91,18 +130,167 @@ def train_svd(X, n_components, n_iter=5, random_state=None):
         Representation matrix of columns. shape = (n_components, n_cols)
     """
 
-    if (random_state == None) or isinstance(random_state, int):
-        random_state = check_random_state(random_state)
+    from sklearn.utils import check_random_state
+
+    if backend not in ('randomized', 'arpack', 'blocked', 'auto'):
+        raise ValueError("backend must be one of 'randomized', 'arpack', 'blocked' "
+                         "and 'auto'; got {}".format(backend))
+
+    random_state = check_random_state(random_state)
 
-    n_features = X.shape[1]
+    n_rows, n_features = X.shape
 
     if n_components >= n_features:
         raise ValueError("n_components must be < n_features;"
                          " got %d >= %d" % (n_components, n_features))
+    if backend in ('arpack', 'blocked') and n_components >= n_rows:
+        raise ValueError("n_components must be < n_rows with {} backend;"
+                         " got {} >= {}".format(backend, n_components, n_rows))
+
+    if backend == 'auto':
+        backend = 'randomized'
+        if max_memory is not None and max_memory < estimate_svd_memory(
+            X, n_components, 'randomized', dtype, n_oversamples):
+            backend = 'blocked'
+
+    if max_memory is not None:
+        estimated = estimate_svd_memory(
+            X, n_components, backend, dtype, n_oversamples, block_size)
+        if estimated > max_memory and backend == 'blocked':
+            block_size = _fit_block_size(X, n_components, dtype, n_oversamples, max_memory)
+        elif estimated > max_memory:
+            raise ValueError("{} svd needs about {:.1f} MB > max_memory {} MB. "
+                             "Use backend='blocked'".format(backend, estimated, max_memory))
+
+    if backend == 'randomized':
+        from sklearn.utils.extmath import randomized_svd
+
+        # randomized_svd keeps the float32 dtype of X
+        U, Sigma, VT = randomized_svd(
+            X.astype(dtype, copy=False), n_components,
+            n_oversamples = n_oversamples,
+            n_iter = n_iter,
+            random_state = random_state)
+    elif backend == 'arpack':
+        from scipy.sparse.linalg import svds
+        from sklearn.utils.extmath import svd_flip
+
+        v0 = random_state.uniform(-1, 1, min(X.shape)).astype(dtype)
+        U, Sigma, VT = svds(X.astype(dtype, copy=False), k=n_components, v0=v0)
+        # svds returns singular values in increasing order
+        order = np.argsort(-Sigma, kind='stable')
+        U, VT = svd_flip(U[:, order], VT[order])
+        Sigma = Sigma[order]
+    else:
+        U, Sigma, VT = _blocked_randomized_svd(X, n_components, n_iter,
+            random_state, dtype, n_oversamples, block_size)
+
+    return U, Sigma, VT
+
+def estimate_svd_memory(X, n_components, backend='randomized', dtype=np.float64,
+    n_oversamples=10, block_size=100000):
+    """
+    :param X: scipy.sparse.csr_matrix
+        Input matrix
+    :param n_components: int
+        Size of embedding dimension
+    :param backend: str
+        'randomized', 'arpack' or 'blocked'. See train_svd
+    :param dtype: numpy.dtype
+        Data type of computation
+    :param n_oversamples: int
+        Number of additional random vectors of randomized backends
+    :param block_size: int
+        Number of rows in a block of 'blocked' backend
+    It returns
+    ----------
+    memory : float
+        Estimated peak memory in MB of train_svd, except the memory of X itself.
+        The copy of X made by dtype conversion and the outputs are included
+    """
+
+    n_rows, n_cols = X.shape
+    nnz = X.nnz
+    itemsize = np.dtype(dtype).itemsize
+    index_size = X.indices.dtype.itemsize
+    k = n_components + n_oversamples
+
+    if X.dtype == dtype:
+        x_copy = 0
+    else:
+        x_copy = nnz * (itemsize + index_size) + (n_rows + 1) * index_size
+
+    if backend == 'randomized':
+        # range finder keeps X Q and X^T Q, and svd of B = Q^T X returns U and VT
+        n_bytes = x_copy + (2 * n_rows * k + 3 * n_cols * k + 2 * k * k) * itemsize
+    elif backend == 'arpack':
+        ncv = min(min(n_rows, n_cols), max(2 * n_components + 1, 20))
+        n_bytes = x_copy + (ncv * min(n_rows, n_cols)
+            + 2 * (n_rows + n_cols) * n_components) * itemsize
+    elif backend == 'blocked':
+        rows = min(block_size, n_rows)
+        block_nnz = int(np.ceil(nnz / max(n_rows, 1) * rows))
+        n_bytes = (n_rows * n_components + 3 * n_cols * k + 2 * rows * k) * itemsize
+        n_bytes += block_nnz * (itemsize + index_size)
+    else:
+        raise ValueError("backend must be one of 'randomized', 'arpack' and 'blocked'; "
+                         "got {}".format(backend))
+    return n_bytes / 1024 ** 2
+
+def _fit_block_size(X, n_components, dtype, n_oversamples, max_memory):
+    # the largest block_size of which estimated memory is within max_memory
+    fixed = estimate_svd_memory(X, n_components, 'blocked', dtype, n_oversamples, 0)
+    per_row = estimate_svd_memory(X, n_components, 'blocked', dtype, n_oversamples, 1) - fixed
+    block_size = int((max_memory - fixed) / per_row) if per_row > 0 else X.shape[0]
+    if block_size < 1:
+        raise ValueError("blocked svd needs at least {:.1f} MB > max_memory {} MB".format(
+            fixed + per_row, max_memory))
+    return block_size
+
+def _iter_row_blocks(X, block_size, dtype):
+    from scipy.sparse import csr_matrix
+
+    # slices data, indices and indptr, so that memory-mapped X is read block by block
+    n_rows, n_cols = X.shape
+    for b in range(0, n_rows, block_size):
+        e = min(b + block_size, n_rows)
+        s, t = X.indptr[b], X.indptr[e]
+        block = csr_matrix((np.asarray(X.data[s:t], dtype=dtype), X.indices[s:t],
+            X.indptr[b:e+1] - s), shape=(e - b, n_cols))
+        yield b, e, block
+
+def _blocked_randomized_svd(X, n_components, n_iter, random_state, dtype,
+    n_oversamples, block_size):
+
+    from sklearn.utils.extmath import svd_flip
+
+    n_rows, n_cols = X.shape
+    k = min(n_components + n_oversamples, n_rows, n_cols)
+
+    def gram_dot(Q):
+        # X^T (X Q), accumulated over row blocks
+        Y = np.zeros((n_cols, Q.shape[1]), dtype=dtype)
+        for _, _, block in _iter_row_blocks(X, block_size, dtype):
+            Y += block.T @ (block @ Q)
+        return Y
+
+    # subspace iteration on X^T X finds the right singular vectors
+    Q = random_state.normal(size=(n_cols, k)).astype(dtype)
+    for _ in range(max(n_iter, 1)):
+        Q, _ = np.linalg.qr(gram_dot(Q))
 
-    U, Sigma, VT = randomized_svd(
-        X, n_components,
-        n_iter = n_iter,
-        random_state = random_state)
+    # eigen decomposition of k x k matrix Q^T X^T X Q = W Lambda W^T
+    G = Q.T @ gram_dot(Q)
+    eigvals, W = np.linalg.eigh((G + G.T) / 2)
+    order = np.argsort(-eigvals, kind='stable')[:n_components]
+    Sigma = np.sqrt(np.clip(eigvals[order], 0, None)).astype(dtype)
+    V = Q @ W[:, order]
 
-    return U, Sigma, VT
\ No newline at end of file
+    # U = X V Sigma^-1, computed block by block
+    with np.errstate(divide='ignore'):
+        inv_sigma = np.where(Sigma > 0, 1 / Sigma, 0).astype(dtype)
+    U = np.empty((n_rows, n_components), dtype=dtype)
+    for b, e, block in _iter_row_blocks(X, block_size, dtype):
+        U[b:e] = (block @ V) * inv_sigma
+    U, VT = svd_flip(U, V.T)
+    return U, Sigma, VT
@@ -0,0 +1,245 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import numpy as np
+from .utils import read_vocab
+from .utils import write_vocab
+
+
+class SimilarityIndex:
+    """
+    Arguments
+    ---------
+    wv : numpy.ndarray
+        Representation matrix. shape = (n_vocabs, dim)
+    idx_to_vocab : list
+        Mapper from int type index to vocab
+    method : str
+        'exact' finds top-k with one matrix-vector product and argpartition.
+        'lsh' finds candidates with random-projection LSH tables and
+        re-ranks them exactly. Default is 'exact'
+    n_bits : int
+        Number of hyperplanes of each LSH table. Default is 12
+    n_tables : int
+        Number of LSH tables. Default is 8
+    dtype : numpy.dtype
+        Data type of normalized vectors. Default is numpy.float32
+    random_state : int or None
+        Random seed of LSH hyperplanes
+
+    Usage
+    -----
+        index = SimilarityIndex(wv, idx_to_row, method='lsh')
+        index.most_similar(('컬렉션', 'L'), topk=10)
+        index.recall(n_samples=100, topk=10)
+
+        index.save('index_dir')
+        index = SimilarityIndex.load('index_dir', mmap_mode='r')
+    """
+
+    def __init__(self, wv, idx_to_vocab, method='exact', n_bits=12,
+        n_tables=8, dtype=np.float32, random_state=None):
+
+        if method not in ('exact', 'lsh'):
+            raise ValueError("method must be 'exact' or 'lsh'; got {}".format(method))
+        if len(idx_to_vocab) != wv.shape[0]:
+            raise ValueError('len(idx_to_vocab) must be same with wv.shape[0]; got {} != {}'.format(
+                len(idx_to_vocab), wv.shape[0]))
+
+        self.method = method
+        self.idx_to_vocab = idx_to_vocab
+        self.vocab_to_idx = {vocab:idx for idx, vocab in enumerate(idx_to_vocab)}
+        self.vectors = _normalize(wv, dtype)
+        if method == 'lsh':
+            rng = np.random.RandomState(random_state)
+            dim = self.vectors.shape[1]
+            self.planes = rng.normal(size=(n_tables, n_bits, dim)).astype(dtype)
+            self.codes, self.orders = self._build_tables()
+
+    def _hash(self, vectors):
+        # (n_tables, n_vectors) int64 bucket codes
+        weights = 1 << np.arange(self.planes.shape[1], dtype=np.int64)
+        return np.stack([((vectors @ planes.T) > 0).astype(np.int64) @ weights
+                         for planes in self.planes])
+
+    def _build_tables(self):
+        codes = self._hash(self.vectors)
+        orders = np.argsort(codes, axis=1, kind='stable')
+        codes = np.take_along_axis(codes, orders, axis=1)
+        return codes, orders
+
+    def _candidates(self, qvec):
+        n_bits = self.planes.shape[1]
+        query_codes = self._hash(qvec.reshape(1, -1))[:, 0]
+        candidates = []
+        for t, code in enumerate(query_codes.tolist()):
+            # probe the bucket and its Hamming-distance-1 neighbors
+            probes = np.asarray([code] + [code ^ (1 << b) for b in range(n_bits)])
+            begin = np.searchsorted(self.codes[t], probes, side='left')
+            end = np.searchsorted(self.codes[t], probes, side='right')
+            candidates += [self.orders[t, b:e] for b, e in zip(begin, end) if b < e]
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(candidates))
+
+    def _topk(self, qvec, topk, exclude=-1, approximate=True):
+        if approximate and self.method == 'lsh':
+            candidates = self._candidates(qvec)
+            sims = self.vectors[candidates] @ qvec
+        else:
+            candidates = None
+            sims = self.vectors @ qvec
+        if exclude >= 0:
+            if candidates is None:
+                sims[exclude] = -np.inf
+            else:
+                sims[candidates == exclude] = -np.inf
+        k = min(topk, sims.shape[0]) if topk > 0 else sims.shape[0]
+        if k < sims.shape[0]:
+            idxs = np.argpartition(-sims, k - 1)[:k]
+        else:
+            idxs = np.arange(sims.shape[0])
+        idxs = idxs[np.argsort(-sims[idxs], kind='stable')]
+        idxs = idxs[np.isfinite(sims[idxs])]
+        scores = sims[idxs]
+        if candidates is not None:
+            idxs = candidates[idxs]
+        return idxs, scores
+
+    def most_similar(self, query, topk=10):
+        """
+        :param query: vocab or numpy.ndarray
+            Query vocab included in idx_to_vocab or query vector
+        :param topk: int
+            Maximum number of similar terms.
+            If set top as negative value, it returns similarity with all words
+        It returns
+        ----------
+        similars : list of tuple
+            List contains tuples (vocab, cosine similarity)
+            Its length is topk
+        """
+
+        if isinstance(query, np.ndarray):
+            q = -1
+            qvec = _normalize(query.reshape(1, -1), self.vectors.dtype)[0]
+        else:
+            q = self.vocab_to_idx.get(query, -1)
+            if q == -1:
+                return []
+            qvec = self.vectors[q]
+        idxs, scores = self._topk(qvec, topk, exclude=q)
+        return [(self.idx_to_vocab[idx], float(score))
+                for idx, score in zip(idxs.tolist(), scores.tolist())]
+
+    def most_similar_batch(self, queries, topk=10, block_size=None, n_jobs=1,
+        block_memory=256):
+        """
+        :param queries: list of vocab
+            Query vocabs. Unknown vocabs return empty rows
+        :param topk: int
+            Number of similar vocabs of each query
+        :param block_size: int or None
+            Number of queries multiplied at once. The similarity matrix of a
+            block and its temporaries use block_size x n_vocabs x (2 x itemsize + 8)
+            bytes. If None, it is derived from block_memory. Default is None
+        :param n_jobs: int
+            Number of threads computing blocks. Default is 1
+        :param block_memory: float
+            Memory (MB) of a block used when block_size is None. Each thread
+            computes one block at a time. Default is 256
+        It returns
+        ----------
+        idxs : numpy.ndarray
+            int64, shape = (n_queries, topk). Padded with -1
+        scores : numpy.ndarray
+            shape = (n_queries, topk). Padded with nan
+
+        It always uses exact search with one matrix multiplication per block.
+        """
+
+        n_vocabs = self.vectors.shape[0]
+        qids = np.asarray([self.vocab_to_idx.get(q, -1) for q in queries], dtype=np.int64)
+        topk = min(topk, n_vocabs - 1)
+        idxs = np.full((qids.shape[0], topk), -1, dtype=np.int64)
+        scores = np.full((qids.shape[0], topk), np.nan, dtype=self.vectors.dtype)
+        if topk <= 0:
+            return idxs, scores
+        if block_size is None:
+            # similarities, their negation for argpartition and int64 indices
+            bytes_per_query = n_vocabs * (2 * self.vectors.dtype.itemsize + 8)
+            block_size = max(1, int(block_memory * 1024 ** 2 / bytes_per_query))
+
+        def search(b):
+            rows = np.flatnonzero(qids[b:b+block_size] >= 0) + b
+            if rows.shape[0] == 0:
+                return
+            sims = self.vectors[qids[rows]] @ self.vectors.T
+            sims[np.arange(rows.shape[0]), qids[rows]] = -np.inf
+            top = np.argpartition(-sims, topk - 1, axis=1)[:, :topk]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1, kind='stable')
+            idxs[rows] = np.take_along_axis(top, order, axis=1)
+            scores[rows] = np.take_along_axis(top_sims, order, axis=1)
+
+        blocks = range(0, qids.shape[0], block_size)
+        if n_jobs > 1:
+            with ThreadPoolExecutor(n_jobs) as executor:
+                list(executor.map(search, blocks))
+        else:
+            for b in blocks:
+                search(b)
+        return idxs, scores
+
+    def recall(self, n_samples=100, topk=10, random_state=None):
+        """
+        It returns average recall@topk of approximate search compared with
+        exact search over n_samples random queries. Exact method returns 1.0
+        """
+
+        if self.method == 'exact':
+            return 1.0
+        rng = np.random.RandomState(random_state)
+        n = self.vectors.shape[0]
+        queries = rng.choice(n, min(n_samples, n), replace=False)
+        recalls = []
+        for q in queries.tolist():
+            qvec = self.vectors[q]
+            exact, _ = self._topk(qvec, topk, exclude=q, approximate=False)
+            approx, _ = self._topk(qvec, topk, exclude=q)
+            if exact.shape[0] > 0:
+                recalls.append(np.intersect1d(exact, approx).shape[0] / exact.shape[0])
+        return float(np.mean(recalls)) if recalls else 1.0
+
+    def save(self, path):
+        """Save index to directory path as .npy arrays and vocab.jsonl"""
+        os.makedirs(path, exist_ok=True)
+        np.save('{}/vectors.npy'.format(path), self.vectors)
+        if self.method == 'lsh':
+            np.save('{}/planes.npy'.format(path), self.planes)
+            np.save('{}/codes.npy'.format(path), self.codes)
+            np.save('{}/orders.npy'.format(path), self.orders)
+        with open('{}/index.json'.format(path), 'w', encoding='utf-8') as f:
+            json.dump({'method': self.method}, f)
+        write_vocab('{}/vocab.jsonl'.format(path), self.idx_to_vocab)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        """Load index saved by save(). With mmap_mode='r', the arrays are memory-mapped"""
+        index = cls.__new__(cls)
+        with open('{}/index.json'.format(path), encoding='utf-8') as f:
+            index.method = json.load(f)['method']
+        index.idx_to_vocab = read_vocab('{}/vocab.jsonl'.format(path))
+        index.vocab_to_idx = {vocab:idx for idx, vocab in enumerate(index.idx_to_vocab)}
+        index.vectors = np.load('{}/vectors.npy'.format(path), mmap_mode=mmap_mode)
+        if index.method == 'lsh':
+            index.planes = np.load('{}/planes.npy'.format(path), mmap_mode=mmap_mode)
+            index.codes = np.load('{}/codes.npy'.format(path), mmap_mode=mmap_mode)
+            index.orders = np.load('{}/orders.npy'.format(path), mmap_mode=mmap_mode)
+        return index
+
+def _normalize(wv, dtype):
+    vectors = np.asarray(wv, dtype=dtype)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
@@ -0,0 +1,81 @@
+import numpy as np
+
+# Approximate memory usage of one (str, int) dict entry.
+# Dict slot and hash table overhead + compact str object of short Korean word
+BYTES_PER_ITEM = 160
+
+
+class SpaceSaving:
+    """
+    Arguments
+    ---------
+    capacity : int
+        Maximum number of items kept in memory
+    shrink_ratio : float
+        When the number of items exceeds capacity, the items are shrunken to
+        about capacity * shrink_ratio most frequent items. Default is 0.75
+
+    Usage
+    -----
+        sketch = SpaceSaving.from_memory(max_memory=100)  # 100 MB
+        for item in stream:
+            sketch.add(item)
+        counts = sketch.counts      # estimated count
+        error = sketch.floor        # |estimated count - true count| <= error
+
+    Description
+    -----------
+    Heavy-hitters counting in the manner of Space-Saving (Metwally et al., 2005)
+    with batched eviction. A new item starts from the current floor, the maximum
+    count of evicted items, so the estimated count never underestimates and
+    overestimates the true count at most floor. Every item of which true count
+    is larger than floor remains in the sketch.
+
+    Hot loops can count directly with the counts dict and the floor value
+
+        counts[item] = counts.get(item, floor) + 1
+
+    and call shrink() when len(counts) > capacity.
+    """
+
+    def __init__(self, capacity, shrink_ratio=0.75):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive; got {}'.format(capacity))
+        self.capacity = capacity
+        self.shrink_ratio = shrink_ratio
+        self.counts = {}
+        self.floor = 0
+
+    @classmethod
+    def from_memory(cls, max_memory, shrink_ratio=0.75):
+        """max_memory : memory budget in MB"""
+        capacity = int(max_memory * 1024 ** 2 / BYTES_PER_ITEM)
+        return cls(max(1, capacity), shrink_ratio)
+
+    def add(self, item):
+        self.counts[item] = self.counts.get(item, self.floor) + 1
+        if len(self.counts) > self.capacity:
+            self.shrink()
+
+    def shrink(self):
+        """Remove infrequent items until the number of items <= capacity * shrink_ratio"""
+        keep = int(self.capacity * self.shrink_ratio)
+        if len(self.counts) <= keep:
+            return
+        values = np.fromiter(self.counts.values(), dtype=np.int64, count=len(self.counts))
+        # items of which count <= threshold are evicted
+        threshold = int(np.partition(values, len(values) - keep - 1)[len(values) - keep - 1])
+        self.counts = {k:v for k, v in self.counts.items() if v > threshold}
+        self.floor = max(self.floor, threshold)
+
+    def update(self, other):
+        """
+        Merge other SpaceSaving. The error bound of merged sketch is the sum of
+        the two floors.
+        """
+        counts = self.counts
+        for k, v in other.counts.items():
+            counts[k] = counts.get(k, 0) + v
+        self.floor += other.floor
+        if len(counts) > self.capacity:
+            self.shrink()
@@ -1,6 +1,21 @@
-from .utils import FourColumnCorpus
-from .utils import FourColumnLRCorpusDecorator
-from .vectorizer import scan_subwords
-from .vectorizer import lr_sents_to_features
-from .vectorizer import scan_features
-from .vectorizer import count_word_features
+from .._lazy import lazy_attributes
+
+_attributes = {
+    'FourColumnCorpus': ('.utils', 'FourColumnCorpus'),
+    'FourColumnLRCorpusDecorator': ('.utils', 'FourColumnLRCorpusDecorator'),
+    'CompiledLRCorpus': ('.utils', 'CompiledLRCorpus'),
+    'compile_lr_corpus': ('.utils', 'compile_lr_corpus'),
+    'scan_subwords': ('.vectorizer', 'scan_subwords'),
+    'lr_sents_to_features': ('.vectorizer', 'lr_sents_to_features'),
+    'scan_features': ('.vectorizer', 'scan_features'),
+    'count_word_features': ('.vectorizer', 'count_word_features'),
+    'count_hashed_word_features': ('.vectorizer', 'count_hashed_word_features'),
+    'hash_feature': ('.vectorizer', 'hash_feature'),
+    'estimate_collision': ('.vectorizer', 'estimate_collision'),
+    'train_lr2vec': ('.train', 'train_lr2vec'),
+    'sweep_lr2vec': ('.train', 'sweep_lr2vec'),
+    'count_shard': ('.shard', 'count_shard'),
+    'merge_shards': ('.shard', 'merge_shards'),
+}
+__all__ = list(_attributes)
+__getattr__, __dir__ = lazy_attributes(__name__, _attributes)
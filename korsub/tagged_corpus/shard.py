@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import numpy as np
+from ..cooccurrence import CooccurrenceCounter
+from ..utils import read_vocab
+from ..utils import save_csr
+from ..utils import write_vocab
+from .utils import FourColumnCorpus
+from .utils import FourColumnLRCorpusDecorator
+from .vectorizer import count_hashed_word_features
+from .vectorizer import count_word_features
+
+
+def count_shard(paths, output, sub_dic, feature_dic=None, n_hash_features=None,
+    min_count=1, prune_per_sent=1000000, prune_min_count=1, xsv_as_adj=False,
+    verbose=True, instrument=None):
+    """
+    Arguments
+    ---------
+    paths : str or list of str
+        FourColumnCorpus file paths counted in this shard
+    output : str
+        Shard directory path
+    sub_dic : set or dict of str
+        Dictionary of L and R subwords. It must be same for all shards
+    feature_dic : set or dict of (str, int) or None
+        Dictionary of features. Either feature_dic or n_hash_features is required
+    n_hash_features : int or None
+        If it is set, features are hashed. See count_hashed_word_features
+    min_count : int
+        Minimum co-occurrence of (word, feature) in the shard. Default is 1,
+        because pairs which are rare in each shard can be frequent after merging
+    prune_per_sent, prune_min_count : int
+        See count_word_features. Default prune_min_count is 1 (no pruning)
+    xsv_as_adj : Boolean
+        See FourColumnCorpus
+
+    Returns
+    -------
+    counter : CooccurrenceCounter
+        It is also saved in output with shard.json
+
+    Usage
+    -----
+        # on each machine
+        count_shard(['corpus_00.txt', 'corpus_01.txt'], 'shard_00', sub_dic, feature_dic)
+
+        # after copying shard directories to one machine
+        X, idx_to_row, idx_to_col = merge_shards(['shard_00', 'shard_01'], min_count=2)
+        pmi, px, py = train_pmi(X)
+    """
+
+    if isinstance(paths, str):
+        paths = [paths]
+    lr_corpus = FourColumnLRCorpusDecorator(FourColumnCorpus(paths, xsv_as_adj))
+    if n_hash_features:
+        counter = count_hashed_word_features(lr_corpus, sub_dic, n_hash_features,
+            min_count, prune_per_sent, prune_min_count, backend='array',
+            verbose=verbose, instrument=instrument)
+    elif feature_dic is not None:
+        counter = count_word_features(lr_corpus, sub_dic, feature_dic,
+            min_count, prune_per_sent, prune_min_count, backend='array',
+            verbose=verbose, instrument=instrument)
+    else:
+        raise ValueError('Either feature_dic or n_hash_features is required')
+
+    counter.save(output)
+    info = {
+        'paths': [os.path.abspath(path) for path in paths],
+        'nnz': counter.nnz,
+        'min_count': min_count,
+        'n_hash_features': n_hash_features,
+        'xsv_as_adj': xsv_as_adj
+    }
+    with open('{}/shard.json'.format(output), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return counter
+
+def merge_shards(shard_paths, min_count=1, dtype=np.int64):
+    """
+    Arguments
+    ---------
+    shard_paths : list of str
+        Shard directories written by count_shard
+    min_count : int
+        Minimum co-occurrence of (word, feature) after merging
+    dtype : numpy.dtype
+        Data type of X. Default is numpy.int64. numpy.int32 halves the memory
+        of X, but counts and their sums must be smaller than 2**31
+
+    Returns
+    -------
+    X : scipy.sparse.csr_matrix
+        (word, feature) count matrix
+    idx_to_row : list
+        Mapper from index to word. Sorted by frequency
+    idx_to_col : list
+        Mapper from index to feature. Sorted by frequency
+
+    Each shard is loaded one at a time. Its vocabularies are remapped to the
+    merged vocabularies and its sorted (key, count) arrays are merged into the
+    accumulated arrays in linear time, so the memory is the merged counts and
+    one shard.
+    """
+
+    hashed = {_shard_info(path).get('n_hash_features') for path in shard_paths}
+    if len(hashed) > 1:
+        raise ValueError('Shards have different n_hash_features; {}'.format(hashed))
+
+    merged = CooccurrenceCounter()
+    for path in shard_paths:
+        merged.update(CooccurrenceCounter.load(path))
+    return merged.to_csr(min_count, dtype)
+
+def _shard_info(path):
+    info_path = '{}/shard.json'.format(path)
+    if not os.path.exists(info_path):
+        return {}
+    with open(info_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Count (word, feature) shards of FourColumnCorpus and merge them')
+    subparsers = parser.add_subparsers(dest='command')
+
+    count = subparsers.add_parser('count', help='count a shard from corpus files')
+    count.add_argument('paths', nargs='+', help='FourColumnCorpus file paths')
+    count.add_argument('--output', required=True, help='shard directory')
+    count.add_argument('--subwords', required=True,
+        help='json lines file of L and R subwords, written by korsub.utils.write_vocab')
+    count.add_argument('--features', default=None,
+        help='json lines file of (subword, direction) features')
+    count.add_argument('--n_hash_features', type=int, default=None)
+    count.add_argument('--min_count', type=int, default=1)
+    count.add_argument('--xsv_as_adj', dest='xsv_as_adj', action='store_true')
+    count.add_argument('--quiet', dest='verbose', action='store_false')
+
+    merge = subparsers.add_parser('merge', help='merge shards into X, idx_to_row, idx_to_col')
+    merge.add_argument('shards', nargs='+', help='shard directories')
+    merge.add_argument('--output', required=True, help='output directory')
+    merge.add_argument('--min_count', type=int, default=2)
+
+    args = parser.parse_args()
+    if args.command == 'count':
+        sub_dic = set(read_vocab(args.subwords))
+        feature_dic = set(read_vocab(args.features)) if args.features else None
+        count_shard(args.paths, args.output, sub_dic, feature_dic,
+            args.n_hash_features, args.min_count, xsv_as_adj=args.xsv_as_adj,
+            verbose=args.verbose)
+    elif args.command == 'merge':
+        X, idx_to_row, idx_to_col = merge_shards(args.shards, args.min_count)
+        os.makedirs(args.output, exist_ok=True)
+        save_csr(args.output, 'X', X)
+        write_vocab('{}/idx_to_row.jsonl'.format(args.output), idx_to_row)
+        write_vocab('{}/idx_to_col.jsonl'.format(args.output), idx_to_col)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,334 @@
+import time
+import numpy as np
 from .vectorizer import scan_subwords
 from .vectorizer import scan_features
 from .vectorizer import count_word_features
+from .vectorizer import count_hashed_word_features
+from ..checkpoint import CheckpointCache
+from ..checkpoint import corpus_fingerprint
 from ..math import train_pmi
 from ..math import train_svd
+from ..instrument import get_instrument
 from ..utils import c_to_x
+from ..utils import load_csr
+from ..utils import read_vocab
+from ..utils import save_csr
+from ..utils import write_vocab
 
 def train_lr2vec(lr_corpus, vocab_min_count=10, feature_min_count=5,
     min_cooccurrence=2, prune_per_sent=100000, min_pmi=0,
-    beta=0.75, n_components=300, verbose=True):
+    beta=0.75, n_components=300, verbose=True, backend='dict',
+    instrument=None, n_hash_features=None, cache_dir=None, cache_size=None,
+    cache_digest=False):
+    """
+    Arguments
+    ---------
+    lr_corpus : FourColumnLRCorpusDecorator, CompiledLRCorpus or list of list of (L, R)
+        LR formatted corpus
+    cache_dir : str or None
+        If it is set, the outputs of scan_subwords, scan_features,
+        count_word_features (with c_to_x), train_pmi and train_svd are saved
+        in cache_dir as checkpoints. Later calls with same corpus files and same
+        parameters of a stage and its upstream stages load the checkpoint, so
+        changing n_components, beta or min_pmi does not count the corpus again.
+        lr_corpus must be backed by files, see korsub.checkpoint.corpus_fingerprint
+    cache_size : float or None
+        Maximum size (MB) of cache_dir. Least recently used checkpoints are
+        removed when it is exceeded. Default is None (no limit)
+    cache_digest : Boolean
+        If True, corpus files are identified by their contents.
+        Else, by their path, size and modification time. Default is False
 
-    idx_to_l, l_to_idx, _, idx_to_r, r_to_idx, _ = scan_subwords(
-        lr_corpus, vocab_min_count)
+    See LR2Vec for the other arguments
 
-    if verbose:
-        print('num of L = {}, R = {} with min count = {}'.format(
-            len(idx_to_l), len(idx_to_r), vocab_min_count))
+    Returns
+    -------
+    X, idx_to_row, idx_to_col, pmi, py, wv, mapper, idx_to_sub
+        idx_to_sub is the sorted list of L and R subwords of scan_subwords,
+        which are used to check the neighbors of words when counting features
+    """
 
-    idx_to_feature, feature_to_idx = scan_features(
-        lr_corpus, l_to_idx, r_to_idx, feature_min_count)
+    instrument = get_instrument(instrument, verbose)
+
+    cache, keys, load, save = _checkpoints(lr_corpus, cache_dir, cache_size,
+        cache_digest, instrument, vocab_min_count, feature_min_count,
+        min_cooccurrence, prune_per_sent, n_hash_features)
+    if cache is not None:
+        keys['train_pmi'] = cache.key('train_pmi', keys['count_word_features'],
+            min_pmi=min_pmi, beta=beta)
+        keys['train_svd'] = cache.key('train_svd', keys['train_pmi'],
+            n_components=n_components)
+
+    X, idx_to_row, idx_to_col, idx_to_sub = _count(lr_corpus, vocab_min_count,
+        feature_min_count, min_cooccurrence, prune_per_sent, backend,
+        instrument, n_hash_features, load, save)
+
+    returns = load('train_pmi', _load_pmi)
+    if returns is not None:
+        pmi, py = returns
+    else:
+        stage = instrument.stage('train_pmi')
+        pmi, px, py = train_pmi(X, min_pmi = min_pmi, beta = beta)
+        stage.end(0, nnz=pmi.nnz)
+        save('train_pmi', lambda path: _save_pmi(path, pmi, py))
+
+    returns = load('train_svd', _load_svd)
+    if returns is not None:
+        wv, mapper = returns
+    else:
+        stage = instrument.stage('train_svd')
+        U, Sigma, VT = train_svd(pmi, n_components)
+        stage.end(0, n_components=Sigma.shape[0])
+        wv = U * (Sigma ** (0.5))
+        mapper = VT.T * (Sigma ** (-0.5))
+        save('train_svd', lambda path: _save_svd(path, wv, mapper))
+
+    return X, idx_to_row, idx_to_col, pmi, py, wv, mapper, idx_to_sub
+
+def sweep_lr2vec(lr_corpus, betas=(0.75,), min_pmis=(0,), dims=(300,),
+    vocab_min_count=10, feature_min_count=5, min_cooccurrence=2,
+    prune_per_sent=100000, verbose=True, backend='dict', instrument=None,
+    n_hash_features=None, n_jobs=1, cache_dir=None, cache_size=None,
+    cache_digest=False):
+    """
+    Arguments
+    ---------
+    lr_corpus : FourColumnLRCorpusDecorator, CompiledLRCorpus or list of list of (L, R)
+        LR formatted corpus
+    betas : list of float
+        Smoothing factors of train_pmi
+    min_pmis : list of float
+        Minimum pmi values of train_pmi
+    dims : list of int
+        Embedding dimensions
+    n_jobs : int
+        Number of processes. Each (beta, min_pmi) variant is trained in one
+        process with its own copy of pmi matrix. Default is 1
+    cache_dir, cache_size, cache_digest :
+        Checkpoint cache of the count matrix. See train_lr2vec
+
+    See train_lr2vec for the other arguments
+
+    Returns
+    -------
+    X : scipy.sparse.csr_matrix
+        (word, feature) count matrix shared by all variants
+    idx_to_row : list
+        Mapper from index to word
+    idx_to_col : list
+        Mapper from index to feature
+    results : list of dict
+        One dict for each (beta, min_pmi, dim) with keys 'beta', 'min_pmi',
+        'dim', 'wv', 'mapper' and 'times'. 'times' is dict of elapsed seconds
+        of 'count', 'train_pmi' and 'train_svd'. 'count' is shared by all variants
+        and 'train_svd' is shared by the dims of same (beta, min_pmi)
+
+    Usage
+    -----
+        X, idx_to_row, idx_to_col, results = sweep_lr2vec(lr_corpus,
+            betas=[0.5, 0.75, 1], min_pmis=[0, 1], dims=[100, 300], n_jobs=4)
+        for result in results:
+            print(result['beta'], result['min_pmi'], result['dim'], result['times'])
+
+    Description
+    -----------
+    X is counted once. The column marginal py of X is computed once and
+    shared by all pmi variants. SVD of each pmi variant runs once with
+    max(dims) components, and the embeddings of smaller dims are its
+    truncations.
+    """
+
+    instrument = get_instrument(instrument, verbose)
+
+    _, _, load, save = _checkpoints(lr_corpus, cache_dir, cache_size,
+        cache_digest, instrument, vocab_min_count, feature_min_count,
+        min_cooccurrence, prune_per_sent, n_hash_features)
+
+    begin = time.perf_counter()
+    X, idx_to_row, idx_to_col, _ = _count(lr_corpus, vocab_min_count,
+        feature_min_count, min_cooccurrence, prune_per_sent, backend,
+        instrument, n_hash_features, load, save)
+    count_time = time.perf_counter() - begin
+
+    py = np.asarray(X.sum(axis=0), dtype=np.float64).reshape(-1)
+    py /= py.sum()
+    n_components = max(dims)
+    variants = [(beta, min_pmi) for beta in betas for min_pmi in min_pmis]
+
+    stage = instrument.stage('sweep', n_variants=len(variants) * len(dims))
+    if n_jobs > 1:
+        from multiprocessing import Pool
+        # X is sent once to each process
+        with Pool(min(n_jobs, len(variants)), initializer=_sweep_init,
+            initargs=(X, py)) as pool:
+            trained = pool.imap(_sweep_worker,
+                [(beta, min_pmi, n_components) for beta, min_pmi in variants])
+            trained = _collect_sweep(trained, stage)
+    else:
+        trained = (_train_variant(X, py, beta, min_pmi, n_components)
+                   for beta, min_pmi in variants)
+        trained = _collect_sweep(trained, stage)
+
+    results = []
+    for (beta, min_pmi), (U, Sigma, VT, times) in zip(variants, trained):
+        times['count'] = count_time
+        for dim in dims:
+            results.append({
+                'beta': beta,
+                'min_pmi': min_pmi,
+                'dim': dim,
+                'wv': U[:,:dim] * (Sigma[:dim] ** (0.5)),
+                'mapper': VT[:dim].T * (Sigma[:dim] ** (-0.5)),
+                'times': dict(times)
+            })
+    stage.end(0, n_variants=len(results))
+
+    return X, idx_to_row, idx_to_col, results
+
+def _train_variant(X, py, beta, min_pmi, n_components):
+    begin = time.perf_counter()
+    pmi, _, _ = train_pmi(X, py=py, min_pmi=min_pmi, beta=beta)
+    pmi_time = time.perf_counter() - begin
+    U, Sigma, VT = train_svd(pmi, n_components)
+    svd_time = time.perf_counter() - begin - pmi_time
+    return U, Sigma, VT, {'train_pmi': pmi_time, 'train_svd': svd_time}
+
+def _collect_sweep(trained, stage):
+    collected = []
+    for U, Sigma, VT, times in trained:
+        collected.append((U, Sigma, VT, times))
+        stage.progress(0, n_done=len(collected), **times)
+    return collected
+
+_sweep_X = None
+_sweep_py = None
+
+def _sweep_init(X, py):
+    global _sweep_X, _sweep_py
+    _sweep_X = X
+    _sweep_py = py
+
+def _sweep_worker(args):
+    beta, min_pmi, n_components = args
+    return _train_variant(_sweep_X, _sweep_py, beta, min_pmi, n_components)
+
+def _checkpoints(lr_corpus, cache_dir, cache_size, cache_digest, instrument,
+    vocab_min_count, feature_min_count, min_cooccurrence, prune_per_sent,
+    n_hash_features):
+    # It returns cache, keys of counting stages, load and save functions.
+    # Without cache_dir, load returns None and save does nothing
+    cache = None
+    if cache_dir is not None:
+        fingerprint = corpus_fingerprint(lr_corpus, cache_digest)
+        if fingerprint is None:
+            raise ValueError('lr_corpus must be backed by files to use cache_dir')
+        cache = CheckpointCache(cache_dir, cache_size)
+
+    # checkpoint keys chained from the corpus
+    keys = {}
+    if cache is not None:
+        keys['scan_subwords'] = cache.key('scan_subwords', fingerprint,
+            vocab_min_count=vocab_min_count)
+        if n_hash_features:
+            keys['count_word_features'] = cache.key('count_word_features',
+                keys['scan_subwords'], min_cooccurrence=min_cooccurrence,
+                prune_per_sent=prune_per_sent, n_hash_features=n_hash_features)
+        else:
+            keys['scan_features'] = cache.key('scan_features', keys['scan_subwords'],
+                feature_min_count=feature_min_count)
+            keys['count_word_features'] = cache.key('count_word_features',
+                keys['scan_features'], min_cooccurrence=min_cooccurrence,
+                prune_per_sent=prune_per_sent)
+
+    def load(name, loader):
+        if cache is None:
+            return None
+        returns = cache.load(name, keys[name], loader)
+        if returns is not None:
+            instrument.stage(name).end(0, checkpoint=keys[name])
+        return returns
+
+    def save(name, saver):
+        if cache is not None:
+            cache.save(name, keys[name], saver)
+
+    return cache, keys, load, save
+
+def _count(lr_corpus, vocab_min_count, feature_min_count, min_cooccurrence,
+    prune_per_sent, backend, instrument, n_hash_features, load, save):
+
+    counted = load('count_word_features', _load_count)
+    if counted is not None:
+        return counted
+
+    returns = load('scan_subwords', lambda path: (
+        read_vocab('{}/idx_to_l.jsonl'.format(path)),
+        read_vocab('{}/idx_to_r.jsonl'.format(path))))
+    if returns is not None:
+        idx_to_l, idx_to_r = returns
+        l_to_idx = {l:idx for idx, l in enumerate(idx_to_l)}
+        r_to_idx = {r:idx for idx, r in enumerate(idx_to_r)}
+    else:
+        idx_to_l, l_to_idx, _, idx_to_r, r_to_idx, _ = scan_subwords(
+            lr_corpus, vocab_min_count, instrument=instrument)
+        save('scan_subwords', lambda path: (
+            write_vocab('{}/idx_to_l.jsonl'.format(path), idx_to_l),
+            write_vocab('{}/idx_to_r.jsonl'.format(path), idx_to_r)))
 
     sub_dic = {sub for sub in idx_to_l}
     sub_dic.update(idx_to_r)
+    idx_to_sub = sorted(sub_dic)
+
+    if n_hash_features:
+        # columns are hash buckets. scan_features pass is skipped
+        C = count_hashed_word_features(lr_corpus, sub_dic, n_hash_features,
+            min_cooccurrence, prune_per_sent, backend=backend,
+            instrument=instrument)
+    else:
+        idx_to_feature = load('scan_features',
+            lambda path: read_vocab('{}/idx_to_feature.jsonl'.format(path)))
+        if idx_to_feature is not None:
+            feature_to_idx = {f:idx for idx, f in enumerate(idx_to_feature)}
+        else:
+            idx_to_feature, feature_to_idx = scan_features(
+                lr_corpus, l_to_idx, r_to_idx, feature_min_count, instrument=instrument)
+            save('scan_features', lambda path: write_vocab(
+                '{}/idx_to_feature.jsonl'.format(path), idx_to_feature))
 
-    C = count_word_features(lr_corpus, sub_dic,
-        feature_to_idx, min_cooccurrence, prune_per_sent)
+        C = count_word_features(lr_corpus, sub_dic,
+            feature_to_idx, min_cooccurrence, prune_per_sent, backend=backend,
+            instrument=instrument)
 
+    stage = instrument.stage('c_to_x')
     X, idx_to_row, idx_to_col = c_to_x(C)
+    stage.end(0, shape=list(X.shape), nnz=X.nnz)
+    save('count_word_features', lambda path: _save_count(
+        path, X, idx_to_row, idx_to_col, idx_to_sub))
+    return X, idx_to_row, idx_to_col, idx_to_sub
 
-    pmi, px, py = train_pmi(X, min_pmi = min_pmi, beta = beta)
-    U, Sigma, VT = train_svd(pmi, n_components)
-    wv = U * (Sigma ** (0.5))
-    mapper = VT.T * (Sigma ** (-0.5))
+def _save_count(path, X, idx_to_row, idx_to_col, idx_to_sub):
+    save_csr(path, 'X', X)
+    write_vocab('{}/idx_to_row.jsonl'.format(path), idx_to_row)
+    write_vocab('{}/idx_to_col.jsonl'.format(path), idx_to_col)
+    write_vocab('{}/idx_to_sub.jsonl'.format(path), idx_to_sub)
+
+def _load_count(path):
+    X = load_csr(path, 'X')
+    idx_to_row = read_vocab('{}/idx_to_row.jsonl'.format(path))
+    idx_to_col = read_vocab('{}/idx_to_col.jsonl'.format(path))
+    idx_to_sub = read_vocab('{}/idx_to_sub.jsonl'.format(path))
+    return X, idx_to_row, idx_to_col, idx_to_sub
+
+def _save_pmi(path, pmi, py):
+    save_csr(path, 'pmi', pmi)
+    np.save('{}/py.npy'.format(path), py)
+
+def _load_pmi(path):
+    return load_csr(path, 'pmi'), np.load('{}/py.npy'.format(path))
 
-    row_to_idx = {row:idx for idx, row in enumerate(idx_to_row)}
+def _save_svd(path, wv, mapper):
+    np.save('{}/wv.npy'.format(path), wv)
+    np.save('{}/mapper.npy'.format(path), mapper)
 
-    return X, idx_to_row, idx_to_col, pmi, py, wv, mapper
+def _load_svd(path):
+    return np.load('{}/wv.npy'.format(path)), np.load('{}/mapper.npy'.format(path))
@@ -1,4 +1,12 @@
+from array import array
+from collections import deque
+import os
 import re
+import numpy as np
+from ..instrument import get_instrument
+from ..utils import sentence_offsets
+
+_non_hangle = re.compile('[^가-힣]')
 
 
 def to_lrs(eojeols, morphtags):
@@ -13,6 +21,10 @@ class FourColumnLRCorpusDecorator:
     def __init__(self, corpus):
         self.corpus = corpus
     def __iter__(self):
+        if getattr(self.corpus, 'n_jobs', 1) > 1:
+            # workers convert sentences to LR format, which is smaller to transfer
+            yield from self.corpus._iter(as_lrs=True)
+            return
         for sent in self.corpus:
             if not sent:
                 continue
@@ -32,12 +44,39 @@ class FourColumnCorpus:
         Maximum number of sent to be yield
         Default is -1 (use all)
 
+    cache_index : Boolean
+        If True, the sentence offset index used by len() and indexing is
+        cached as {path}.sents.npy. See korsub.utils.sentence_offsets
+    n_jobs : int
+        Number of parsing processes. If n_jobs > 1, files are cut into
+        byte-range chunks at sentence boundaries and parsed in a process pool
+        while the consumer iterates. Sentences are yielded in the same order
+        as n_jobs=1, except that empty sentences are not yielded. Default is 1
+    chunk_size : int
+        Approximate bytes of a chunk parsed by a process. Default is 4MB
+    prefetch : int
+        Number of chunks requested ahead per process. The parsed sentences
+        waiting for the consumer are bounded by n_jobs x prefetch chunks.
+        Default is 2
+    instrument : korsub.instrument.Instrument or None
+        Sink of the end event of stage 'four_column_corpus', which reports
+        the number of malformed lines. Default is silent
+
     Usage
     -----
         train_corpus = TrainCorpus(path)
         for sent in train_corpus:
             # do something
 
+        len(train_corpus)       # number of blank-line separated sentences
+        train_corpus[100]       # list of (eojeol, ((morph, tag), (morph, tag)))
+
+        # parse in 4 processes
+        train_corpus = FourColumnCorpus(paths, n_jobs=4)
+        for sent in train_corpus:
+            # do something
+        train_corpus.num_malformed  # skipped lines of last iteration
+
     Description
     -----------
     Tap separated four columns. <어절, 세종 말뭉치의 형태소 품사, LR 0, LR 1>
@@ -63,50 +102,308 @@ class FourColumnCorpus:
 
     """
 
-    def __init__(self, paths, xsv_as_adj=False, num_sent=-1):
+    def __init__(self, paths, xsv_as_adj=False, num_sent=-1, cache_index=True,
+        n_jobs=1, chunk_size=4194304, prefetch=2, instrument=None):
+
         if isinstance(paths, str):
             paths = [paths]
         self.paths = paths
         self.xsv_as_adj = xsv_as_adj
         self._col = 2 if xsv_as_adj else 3
         self.num_sent = num_sent
+        self.cache_index = cache_index
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.prefetch = prefetch
+        self.instrument = instrument
+        self.num_malformed = 0
+        self._offsets = None
+
+    def _parse(self, doc):
+        # It returns (eojeol, morphtags) of a line. It raises error for malformed line
+        return _parse_line(doc, self._col)
+
+    def _get_offsets(self):
+        if self._offsets is None:
+            offsets = [sentence_offsets(path, self.cache_index) for path in self.paths]
+            # cumulative number of sentences of files
+            bounds = np.cumsum([0] + [o.shape[0] - 1 for o in offsets])
+            self._offsets = (offsets, bounds)
+        return self._offsets
+
+    def __len__(self):
+        _, bounds = self._get_offsets()
+        n = int(bounds[-1])
+        return min(n, self.num_sent) if self.num_sent > 0 else n
+
+    def __getitem__(self, index):
+        n = len(self)
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(n))]
+        if index < 0:
+            index += n
+        if not (0 <= index < n):
+            raise IndexError('FourColumnCorpus index out of range; {}'.format(index))
+        offsets, bounds = self._get_offsets()
+        i_path = int(np.searchsorted(bounds, index, side='right')) - 1
+        i = index - int(bounds[i_path])
+        begin, end = int(offsets[i_path][i]), int(offsets[i_path][i+1])
+        with open(self.paths[i_path], 'rb') as f:
+            f.seek(begin)
+            lines = f.read(end - begin).decode('utf-8').split('\n')
+        sents, _ = _parse_sents(lines, self._col)
+        return sents[0] if sents else []
 
     def __iter__(self):
-        def parse(morphtags):
-            lr = morphtags.split()
-            morph0, tag0 = lr[0].rsplit('/', 1)
-            if len(lr) == 2:
-                morph1, tag1 = lr[1].rsplit('/', 1)
-            else:
-                morph1, tag1 = '', ''
-            return ((morph0, tag0), (morph1, tag1))
-
-        def normalize(s):
-            pattern = re.compile('[^가-힣]')
-            return pattern.sub('', s)
+        return self._iter()
 
-        sent = []
+    def _iter(self, as_lrs=False):
+        stage = get_instrument(self.instrument).stage('four_column_corpus', n_jobs=self.n_jobs)
+        self.num_malformed = 0
+        sents = self._iter_parallel(as_lrs) if self.n_jobs > 1 else self._iter_sequential()
         n_sents = 0
+        try:
+            for sent in sents:
+                if self.num_sent > 0 and n_sents >= self.num_sent:
+                    break
+                yield sent
+                n_sents += 1
+        finally:
+            # terminates the process pool when iteration stops early
+            sents.close()
+        stage.end(n_sents, num_malformed=self.num_malformed)
+
+    def _iter_sequential(self):
+        sent = []
         for path in self.paths:
             with open(path, encoding='utf-8') as f:
                 for doc in f:
-                    if self.num_sent > 0 and n_sents >= self.num_sent:
-                        break
                     doc = doc.strip()
 
                     if not doc:
                         yield sent
-                        n_sents += 1
                         sent = []
                         continue
 
                     try:
-                        cols = doc.split('\t')
-                        eojeol = cols[0]
-                        morphtags = cols[self._col]
-                        sent.append((normalize(eojeol), parse(morphtags)))
-                    except:
-                        continue
+                        sent.append(self._parse(doc))
+                    except (IndexError, ValueError):
+                        self.num_malformed += 1
 
                 if sent:
-                    yield sent
\ No newline at end of file
+                    yield sent
+                    sent = []
+
+    def _chunks(self):
+        # byte ranges of about chunk_size, cut at the beginning of sentences
+        for path in self.paths:
+            offsets = sentence_offsets(path, self.cache_index)
+            begin, end = int(offsets[0]), int(offsets[-1])
+            targets = np.arange(begin + self.chunk_size, end, self.chunk_size)
+            bounds = np.unique(offsets[np.searchsorted(offsets, targets)])
+            bounds = [begin] + bounds.tolist() + [end]
+            for b, e in zip(bounds, bounds[1:]):
+                if b < e:
+                    yield path, b, e
+
+    def _iter_parallel(self, as_lrs=False):
+        from multiprocessing import Pool
+
+        chunks = self._chunks()
+        with Pool(self.n_jobs) as pool:
+            # bounded window of pending chunks keeps order and limits memory
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_parse_chunk, (chunk, self._col, as_lrs)))
+                if len(pending) >= self.n_jobs * self.prefetch:
+                    break
+            while pending:
+                sents, num_malformed = pending.popleft().get()
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    pending.append(pool.apply_async(_parse_chunk, (chunk, self._col, as_lrs)))
+                self.num_malformed += num_malformed
+                yield from sents
+
+def _parse_line(doc, col):
+    cols = doc.split('\t')
+    return (_non_hangle.sub('', cols[0]), _parse_morphtags(cols[col]))
+
+def _parse_sents(lines, col):
+    # It returns non-empty sentences of lines and the number of malformed lines
+    sents = []
+    sent = []
+    num_malformed = 0
+    for doc in lines:
+        doc = doc.strip()
+        if not doc:
+            if sent:
+                sents.append(sent)
+                sent = []
+            continue
+        try:
+            sent.append(_parse_line(doc, col))
+        except (IndexError, ValueError):
+            num_malformed += 1
+    if sent:
+        sents.append(sent)
+    return sents, num_malformed
+
+def _parse_chunk(args, col, as_lrs=False):
+    path, begin, end = args
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        lines = f.read(end - begin).decode('utf-8').split('\n')
+    sents, num_malformed = _parse_sents(lines, col)
+    if as_lrs:
+        sents = [to_lrs(*zip(*sent)) for sent in sents]
+    return sents, num_malformed
+
+def _parse_morphtags(morphtags):
+    lr = morphtags.split()
+    morph0, tag0 = lr[0].rsplit('/', 1)
+    if len(lr) == 2:
+        morph1, tag1 = lr[1].rsplit('/', 1)
+    else:
+        morph1, tag1 = '', ''
+    return ((morph0, tag0), (morph1, tag1))
+
+def compile_lr_corpus(lr_corpus, path):
+    """
+    Arguments
+    ---------
+    lr_corpus : iterable of list of (L, R) tuples
+        For example, FourColumnLRCorpusDecorator
+    path : str
+        Directory path of compiled corpus
+
+    Returns
+    -------
+    CompiledLRCorpus
+
+    Usage
+    -----
+        lr_corpus = FourColumnLRCorpusDecorator(FourColumnCorpus(paths))
+        compiled = compile_lr_corpus(lr_corpus, 'corpus.lr')
+
+        # later, without parsing
+        compiled = CompiledLRCorpus('corpus.lr')
+        lr2vec = LR2Vec(compiled)
+
+    Description
+    -----------
+    The directory contains
+
+        strings.txt : string table, one str per line. Index 0 is empty str
+        l.npy : int32 array, string index of L of each eojeol
+        r.npy : int32 array, string index of R of each eojeol
+        offsets.npy : int64 array, offsets[i] is the first eojeol of i-th sent
+    """
+
+    os.makedirs(path, exist_ok=True)
+    str_to_idx = {'': 0}
+    idx_to_str = ['']
+    l_ids = array('i')
+    r_ids = array('i')
+    offsets = array('q', [0])
+
+    def encode(s):
+        i = str_to_idx.get(s, -1)
+        if i == -1:
+            if '\n' in s:
+                raise ValueError('L or R must not contain new line; got {}'.format(s))
+            i = len(idx_to_str)
+            str_to_idx[s] = i
+            idx_to_str.append(s)
+        return i
+
+    for lrs in lr_corpus:
+        if not lrs:
+            continue
+        for l, r in lrs:
+            l_ids.append(encode(l))
+            r_ids.append(encode(r))
+        offsets.append(len(l_ids))
+
+    with open('{}/strings.txt'.format(path), 'w', encoding='utf-8') as f:
+        for s in idx_to_str:
+            f.write('{}\n'.format(s))
+    np.save('{}/l.npy'.format(path), np.frombuffer(l_ids, dtype=np.int32))
+    np.save('{}/r.npy'.format(path), np.frombuffer(r_ids, dtype=np.int32))
+    np.save('{}/offsets.npy'.format(path), np.frombuffer(offsets, dtype=np.int64))
+
+    return CompiledLRCorpus(path)
+
+class CompiledLRCorpus:
+    """
+    Arguments
+    ---------
+    path : str
+        Directory path created by compile_lr_corpus
+    as_ids : Boolean
+        If True, it yields (l_ids, r_ids) numpy arrays of each sent.
+        Else, it yields list of (L, R) str tuples same with
+        FourColumnLRCorpusDecorator. Default is False
+    mmap_mode : str or None
+        mmap_mode of numpy.load. Default is 'r'
+    block_size : int
+        Number of sents decoded at once. Default is 10000
+
+    Usage
+    -----
+        lr_corpus = CompiledLRCorpus('corpus.lr')
+        for lrs in lr_corpus:
+            # [('컬렉션', '이라는'), ('이름', '으로'), ('전시회', '를'), ('열', '었다')]
+    """
+
+    def __init__(self, path, as_ids=False, mmap_mode='r', block_size=10000):
+        self.path = path
+        self.as_ids = as_ids
+        self.block_size = block_size
+        with open('{}/strings.txt'.format(path), encoding='utf-8') as f:
+            self.idx_to_str = [s[:-1] for s in f]
+        self.l = np.load('{}/l.npy'.format(path), mmap_mode=mmap_mode)
+        self.r = np.load('{}/r.npy'.format(path), mmap_mode=mmap_mode)
+        self.offsets = np.load('{}/offsets.npy'.format(path), mmap_mode=mmap_mode)
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def __iter__(self):
+        l, r, offsets = self.l, self.r, self.offsets
+        if self.as_ids:
+            for b, e in zip(offsets[:-1], offsets[1:]):
+                yield l[b:e], r[b:e]
+            return
+
+        strings = self.idx_to_str
+        n_sents = len(self)
+        for bs in range(0, n_sents, self.block_size):
+            es = min(bs + self.block_size, n_sents)
+            bounds = offsets[bs:es+1].tolist()
+            base = bounds[0]
+            ls = [strings[i] for i in l[base:bounds[-1]].tolist()]
+            rs = [strings[i] for i in r[base:bounds[-1]].tolist()]
+            for b, e in zip(bounds, bounds[1:]):
+                yield list(zip(ls[b-base:e-base], rs[b-base:e-base]))
+
+    def subword_counts(self):
+        """
+        Returns
+        -------
+        lsubs : dict
+            L counter. Keys are in order of first occurrence
+        rsubs : dict
+            R counter, except empty str. Keys are in order of first occurrence
+        """
+        def count(ids, skip_empty):
+            ids = np.asarray(ids)
+            unique, first, counts = np.unique(ids, return_index=True, return_counts=True)
+            order = np.argsort(first, kind='stable')
+            counter = {}
+            for i, c in zip(unique[order].tolist(), counts[order].tolist()):
+                if skip_empty and i == 0:
+                    continue
+                counter[self.idx_to_str[i]] = c
+            return counter
+        return count(self.l, False), count(self.r, True)
@@ -1,6 +1,10 @@
 from collections import defaultdict
+import math
+import zlib
+from ..cooccurrence import CooccurrenceCounter
+from ..instrument import get_instrument
 
-def scan_subwords(lr_format_sents, min_count=10):
+def scan_subwords(lr_format_sents, min_count=10, instrument=None):
     """
     Arguments
     ---------
@@ -16,6 +20,8 @@ def scan_subwords(lr_format_sents, min_count=10):
 
     min_count : int
         Minumum occurrence of subword
+    instrument : korsub.instrument.Instrument or None
+        Sink of the end event of stage 'scan_subwords'. Default is silent
 
     Returns
     -------
@@ -37,13 +43,20 @@ def scan_subwords(lr_format_sents, min_count=10):
     idx_to_l, l_to_idx, lsubs, idx_to_r, r_to_idx, rsubs = scan_subwords(corpus)
     """
 
-    lsubs = defaultdict(int)
-    rsubs = defaultdict(int)
-    for lrs in lr_format_sents:
-        for l, r in lrs:
-            lsubs[l] += 1
-            if r:
-                rsubs[r] += 1
+    stage = get_instrument(instrument).stage('scan_subwords')
+    if hasattr(lr_format_sents, 'subword_counts'):
+        # CompiledLRCorpus counts subwords from int arrays
+        lsubs, rsubs = lr_format_sents.subword_counts()
+        i = len(lr_format_sents)
+    else:
+        lsubs = defaultdict(int)
+        rsubs = defaultdict(int)
+        i = 0
+        for i, lrs in enumerate(lr_format_sents, start=1):
+            for l, r in lrs:
+                lsubs[l] += 1
+                if r:
+                    rsubs[r] += 1
     lsubs = {sub:c for sub, c in lsubs.items() if c >= min_count}
     rsubs = {sub:c for sub, c in rsubs.items() if c >= min_count}
 
@@ -51,6 +64,7 @@ def scan_subwords(lr_format_sents, min_count=10):
     idx_to_r = [r for r in sorted(rsubs, key=lambda x:-rsubs[x])]
     l_to_idx = {l:idx for idx, l in enumerate(idx_to_l)}
     r_to_idx = {r:idx for idx, r in enumerate(idx_to_r)}
+    stage.end(i, num_l=len(idx_to_l), num_r=len(idx_to_r))
 
     return idx_to_l, l_to_idx, lsubs, idx_to_r, r_to_idx, rsubs
 
@@ -149,12 +163,39 @@ def lr_sents_to_features(lrs, lsubs, rsubs, check=False):
 
     return word_and_features
 
-def scan_features(lr_format_sents, lsubs, rsubs, min_count=5):
+def scan_features(lr_format_sents, lsubs, rsubs, min_count=5,
+    verbose=True, instrument=None):
+    """
+    Arguments
+    ---------
+    lr_format_sents : list of list of (L,R) tuples
+        LR formatted corpus
+    lsubs : set or dict of str
+        Dictionary of L subwords
+    rsubs : set or dict of str
+        Dictionary of R subwords
+    min_count : int
+        Minimum occurrence of feature
+    verbose : Boolean
+        If True, it shows progress
+    instrument : korsub.instrument.Instrument or None
+        Sink of progress events of stage 'scan_features'.
+        If None, PrintInstrument is used when verbose is True
+
+    Returns
+    -------
+    idx_to_feature : list of (str, int)
+        Features sorted by frequency
+    feature_to_idx : dict
+        Feature to idx
+    """
+
+    stage = get_instrument(instrument, verbose).stage('scan_features')
     counter = defaultdict(int)
-    i = 0
+    i = -1
     for i, lrs in enumerate(lr_format_sents):
         if i % 10000 == 0:
-            print('\rscanning features from {} sents'.format(i), end='')
+            stage.progress(i, num_features=len(counter))
         word_and_features = lr_sents_to_features(
             lrs, lsubs, rsubs, check=True)
         for _, features in word_and_features:
@@ -162,7 +203,7 @@ def scan_features(lr_format_sents, lsubs, rsubs, min_count=5):
                 counter[feature] += 1
     idx_to_feature = [f for f,c in sorted(counter.items(), key=lambda x:-x[1]) if c >= min_count]
     feature_to_idx = {f:idx for idx, f in enumerate(idx_to_feature)}
-    print('\rscanning features from {} sents was done'.format(i))
+    stage.end(i+1, num_features=len(idx_to_feature))
     return idx_to_feature, feature_to_idx
 
 def prune(C, min_count):
@@ -172,27 +213,240 @@ def prune(C, min_count):
     return C
 
 def count_word_features(lr_format_sents, sub_dic, feature_dic,
-    min_count=2, prune_per_sent=100000, prune_min_count=2):
+    min_count=2, prune_per_sent=100000, prune_min_count=2, backend='dict',
+    verbose=True, instrument=None, max_memory=None, spill_dir=None):
+    """
+    Arguments
+    ---------
+    lr_format_sents : list of list of (L,R) tuples
+        LR formatted corpus
+    sub_dic : set or dict of str
+        Dictionary of L and R subwords
+    feature_dic : set or dict of (str, int)
+        Dictionary of features
+    min_count : int
+        Minimum co-occurrence of (word, feature)
+    prune_per_sent : int
+        (word, feature) pairs of which count is smaller than prune_min_count
+        are removed at every prune_per_sent sentences
+    prune_min_count : int
+        Minimum count used when pruning
+    backend : str
+        'dict' counts with nested dict.
+        'array' counts with korsub.cooccurrence.CooccurrenceCounter, which
+        interns words and features to int ids and uses far less memory
+    verbose : Boolean
+        If True, it shows progress
+    instrument : korsub.instrument.Instrument or None
+        Sink of progress and prune events of stage 'count_word_features'.
+        If None, PrintInstrument is used when verbose is True
+    max_memory : float or None
+        Memory budget (MB) of the counts. If it is set, the counts are exact;
+        pruning is disabled and the counts are spilled to sorted run files
+        on disk when they reach the budget. The runs are merged at the end
+        with min_count. See korsub.cooccurrence.CooccurrenceCounter
+    spill_dir : str or None
+        Directory of the run files. Default is the system temporary directory
+
+    Returns
+    -------
+    C : dict of dict or CooccurrenceCounter
+        C[(subword, 'L' or 'R')][feature] = count.
+        With backend='array', it returns CooccurrenceCounter. Use C.to_dict()
+        for nested dict or c_to_x(C) for sparse matrix
+    """
+
+    if not (backend in ('array', 'dict')):
+        raise ValueError("backend must be 'dict' or 'array'; got {}".format(backend))
+    if max_memory:
+        counter = CooccurrenceCounter(max_memory=max_memory, spill_dir=spill_dir)
+        prune_per_sent = 0
+    elif backend == 'array':
+        counter = CooccurrenceCounter()
+    else:
+        counter = None
+        C = defaultdict(lambda: defaultdict(int))
 
-    C = defaultdict(lambda: defaultdict(int))
+    stage = get_instrument(instrument, verbose).stage('count_word_features', backend=backend)
 
+    i = -1
     for i, lrs in enumerate(lr_format_sents):
         if i % 10000 == 0:
-            print('\rcounting (word, features) from {} sents'.format(i), end='')
-        if i % prune_per_sent == 0:
-            C = prune(C, prune_min_count)
+            stage.progress(i)
+        if prune_per_sent > 0 and i > 0 and i % prune_per_sent == 0:
+            if counter is None:
+                C = prune(C, prune_min_count)
+                stage.prune(i, num_words=len(C))
+            else:
+                counter.prune(prune_min_count)
+                stage.prune(i, nnz=counter.nnz)
 
         word_and_features = lr_sents_to_features(
             lrs, sub_dic, sub_dic, check=True)
 
         for word, features in word_and_features:
+            if counter is not None:
+                features = [feature for feature in features if feature in feature_dic]
+                if features:
+                    counter.add_features(word, features)
+                continue
             for feature in features:
                 if not (feature in feature_dic):
                     continue
                 C[word][feature] += 1
 
-    print('\rcounting (word, features) from {} sents was done'.format(i))
+    if counter is not None:
+        counter.prune(min_count)
+        stage.end(i+1, nnz=counter.nnz)
+        return counter if backend == 'array' else counter.to_dict()
 
     C = prune(C, min_count)
     C = {w:dict(fd) for w, fd in C.items() if fd}
-    return C
\ No newline at end of file
+    stage.end(i+1, num_words=len(C))
+    return C
+
+def hash_feature(feature, n_features):
+    """
+    Arguments
+    ---------
+    feature : tuple
+        (subword, direction). For example ('이라는', 1)
+    n_features : int
+        Number of hash buckets
+
+    Returns
+    -------
+    bucket : int
+        Column index in [0, n_features). CRC32 is used, so the bucket of a
+        feature is same for every process and every run
+    """
+
+    sub, direction = feature
+    return zlib.crc32('{}\t{}'.format(sub, direction).encode('utf-8')) % n_features
+
+def estimate_collision(n_occupied, n_features):
+    """
+    Arguments
+    ---------
+    n_occupied : int
+        Number of buckets which at least one feature is hashed to
+    n_features : int
+        Number of hash buckets
+
+    Returns
+    -------
+    n_distinct : float
+        Estimated number of distinct features, -n ln(1 - m/n)
+    collision_rate : float
+        Estimated fraction of distinct features which share their bucket
+        with another feature, 1 - m / n_distinct
+    """
+
+    if n_occupied >= n_features:
+        return float('inf'), 1.0
+    n_distinct = -n_features * math.log(1 - n_occupied / n_features)
+    if n_distinct == 0:
+        return 0.0, 0.0
+    return n_distinct, 1 - n_occupied / n_distinct
+
+def count_hashed_word_features(lr_format_sents, sub_dic, n_features=2**20,
+    min_count=2, prune_per_sent=100000, prune_min_count=2, backend='dict',
+    verbose=True, instrument=None, return_collision=False):
+    """
+    Arguments
+    ---------
+    lr_format_sents : list of list of (L,R) tuples
+        LR formatted corpus
+    sub_dic : set or dict of str
+        Dictionary of L and R subwords
+    n_features : int
+        Number of hash buckets. Default is 2**20
+    min_count : int
+        Minimum co-occurrence of (word, bucket)
+    prune_per_sent : int
+        (word, bucket) pairs of which count is smaller than prune_min_count
+        are removed at every prune_per_sent sentences. If 0, they are not pruned
+    prune_min_count : int
+        Minimum count used when pruning
+    backend : str
+        'dict' or 'array'. See count_word_features
+    verbose : Boolean
+        If True, it shows progress
+    instrument : korsub.instrument.Instrument or None
+        Sink of progress and prune events of stage 'count_hashed_word_features'.
+        The end event reports the estimated collision rate
+    return_collision : Boolean
+        If True, it also returns (n_occupied, n_distinct, collision_rate).
+        See estimate_collision
+
+    Returns
+    -------
+    C : dict of dict or CooccurrenceCounter
+        C[(subword, 'L' or 'R')][bucket] = count, where bucket = hash_feature(feature)
+
+    Usage
+    -----
+        C = count_hashed_word_features(lr_corpus, sub_dic, n_features=2**18)
+        X, idx_to_row, idx_to_col = c_to_x(C)   # idx_to_col is list of bucket
+
+    Description
+    -----------
+    Unlike count_word_features, it does not need the feature dictionary of
+    scan_features. Every feature of lr_sents_to_features is mapped to one of
+    n_features buckets, so the memory of columns is bounded by n_features and
+    the corpus is scanned only once. Features which share a bucket are summed.
+    """
+
+    if backend == 'array':
+        counter = CooccurrenceCounter()
+    elif backend == 'dict':
+        counter = None
+        C = defaultdict(lambda: defaultdict(int))
+    else:
+        raise ValueError("backend must be 'dict' or 'array'; got {}".format(backend))
+
+    stage = get_instrument(instrument, verbose).stage(
+        'count_hashed_word_features', backend=backend, n_features=n_features)
+    occupied = set()
+
+    i = -1
+    for i, lrs in enumerate(lr_format_sents):
+        if i % 10000 == 0:
+            stage.progress(i, n_occupied=len(occupied))
+        if prune_per_sent > 0 and i > 0 and i % prune_per_sent == 0:
+            if counter is None:
+                C = prune(C, prune_min_count)
+                stage.prune(i, num_words=len(C))
+            else:
+                counter.prune(prune_min_count)
+                stage.prune(i, nnz=counter.nnz)
+
+        word_and_features = lr_sents_to_features(
+            lrs, sub_dic, sub_dic, check=True)
+
+        for word, features in word_and_features:
+            buckets = [hash_feature(feature, n_features) for feature in features]
+            occupied.update(buckets)
+            if counter is not None:
+                counter.add_features(word, buckets)
+                continue
+            Cw = C[word]
+            for bucket in buckets:
+                Cw[bucket] += 1
+
+    n_distinct, collision_rate = estimate_collision(len(occupied), n_features)
+
+    if counter is not None:
+        counter.prune(min_count)
+        C = counter
+        stage.end(i+1, nnz=counter.nnz, n_occupied=len(occupied),
+            n_distinct=n_distinct, collision_rate=collision_rate)
+    else:
+        C = prune(C, min_count)
+        C = {w:dict(fd) for w, fd in C.items() if fd}
+        stage.end(i+1, num_words=len(C), n_occupied=len(occupied),
+            n_distinct=n_distinct, collision_rate=collision_rate)
+
+    if return_collision:
+        return C, (len(occupied), n_distinct, collision_rate)
+    return C
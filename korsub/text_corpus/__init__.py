@@ -1,3 +1,10 @@
-from .utils import Sentences
-from .vectorizer import scan_subwords
-from .vectorizer import subword_features
+from .._lazy import lazy_attributes
+
+_attributes = {
+    'Sentences': ('.utils', 'Sentences'),
+    'scan_subwords': ('.vectorizer', 'scan_subwords'),
+    'subword_features': ('.vectorizer', 'subword_features'),
+    'train_lr2vec': ('.train', 'train_lr2vec'),
+}
+__all__ = list(_attributes)
+__getattr__, __dir__ = lazy_attributes(__name__, _attributes)
@@ -0,0 +1,176 @@
+from ..cooccurrence import CooccurrenceCounter
+from ..embedding import LR2Vec
+from ..instrument import get_instrument
+from ..math import train_pmi
+from ..math import train_svd
+from .vectorizer import _match_budget
+from .vectorizer import _match_words
+from .vectorizer import _WordScanner
+
+
+def train_lr2vec(sentences, submax=5, vocab_min_count=10, feature_min_count=5,
+    min_cooccurrence=2, prune_per_sent=1000000, prune_min_count=2, min_pmi=0,
+    beta=0.75, n_components=300, verbose=True, instrument=None,
+    max_memory=None, spill_dir=None):
+    """
+    Arguments
+    ---------
+    sentences : Sentences or iterable of list of str
+        Whitespace tokenized sentences. It is read only once
+    submax : int
+        Maximum length of features
+    vocab_min_count : int
+        Minimum occurrence of subword. Same with min_count of scan_subwords
+    feature_min_count : int
+        Minimum occurrence of feature counted by scan_subwords
+    min_cooccurrence : int
+        Minimum co-occurrence of (subword, feature)
+    prune_per_sent : int
+        Subwords, features and (subword, feature) candidates of which count
+        is smaller than prune_min_count are removed at every prune_per_sent sentences
+    prune_min_count : int
+        Minimum count used when pruning
+    verbose : Boolean
+        If True, it shows progress
+    instrument : korsub.instrument.Instrument or None
+        Sink of events of stages 'count', 'filter', 'train_pmi' and 'train_svd'.
+        If None, PrintInstrument is used when verbose is True
+    max_memory : float or None
+        Memory budget (MB) of the co-occurrence counts. If it is set, pruning is
+        disabled and the counts are spilled to disk, so the counts are exact.
+        Up to a quarter of the budget is used by the cache of per-word candidates.
+        See korsub.cooccurrence.CooccurrenceCounter
+    spill_dir : str or None
+        Directory of the spilled count files
+
+    Returns
+    -------
+    model : korsub.LR2Vec
+        Rows are subwords and columns are (direction, feature). The rows are
+        not (subword, 'L' or 'R') of models trained on LR corpus, so
+        infer_corpus and transform_corpus, which read LR corpus, raise ValueError
+
+    Usage
+    -----
+        from korsub.text_corpus import Sentences, train_lr2vec
+
+        model = train_lr2vec(Sentences('corpus.txt'), n_components=100)
+        model.most_similar('아이오아이')
+
+    Description
+    -----------
+    It is one-pass version of scan_subwords followed by subword_features.
+    Subwords and features are unknown while reading, so every prefix of each
+    word is counted with every candidate feature, and a candidate of r and its
+    right neighbor part is kept as (1, r, right) until both parts are checked.
+    After reading, candidates of which subword or parts are not frequent
+    enough are removed and (1, r, right) becomes (1, r + right). Without pruning,
+    the count matrix is same with the one of the two passes.
+    """
+
+    instrument = get_instrument(instrument, verbose)
+    subwords, features, counter, n_sents = _count(sentences, submax,
+        prune_per_sent, prune_min_count, instrument, max_memory, spill_dir)
+
+    stage = instrument.stage('filter')
+    subwords = {sub for sub, count in subwords.items() if count >= vocab_min_count}
+    features = {f for f, count in features.items() if count >= feature_min_count}
+
+    def col_mapper(col):
+        if not all(part in features for part in col[1:] if part):
+            return None
+        if len(col) == 3:
+            # (1, r, right) -> (1, r + right)
+            return (1, col[1] + col[2])
+        return col
+
+    counter = counter.relabel(lambda sub: sub if sub in subwords else None, col_mapper)
+    X, idx_to_row, idx_to_col = counter.to_csr(min_cooccurrence)
+    stage.end(n_sents, shape=list(X.shape), nnz=X.nnz)
+
+    stage = instrument.stage('train_pmi')
+    pmi, px, py = train_pmi(X, min_pmi = min_pmi, beta = beta)
+    stage.end(0, nnz=pmi.nnz)
+
+    stage = instrument.stage('train_svd')
+    U, Sigma, VT = train_svd(pmi, n_components)
+    stage.end(0, n_components=Sigma.shape[0])
+
+    model = LR2Vec(None, vocab_min_count, feature_min_count, min_cooccurrence,
+        beta, min_pmi, n_components, prune_per_sent, verbose)
+    model.X = X
+    model.idx_to_row = idx_to_row
+    model.idx_to_col = idx_to_col
+    model.pmi = pmi
+    model.py = py
+    model.wv = U * (Sigma ** (0.5))
+    model.mapper = VT.T * (Sigma ** (-0.5))
+    model._col_to_idx = None
+    return model
+
+def _count(sentences, submax, prune_per_sent, prune_min_count, instrument,
+    max_memory, spill_dir, flush_per_sent=10000, cache_size=100000):
+
+    # vocabulary counts are same with scan_subwords
+    scanner = _WordScanner(submax)
+    word_counts = scanner.word_counts
+
+    # candidates of subword_features without dictionary check
+    def candidates(word):
+        n = len(word)
+        lefts = [(0, word[-i:]) for i in range(1, min(submax, n) + 1)]
+        rights = [word[:i] for i in range(2, min(submax, n) + 1)]
+        subs = [(word[:e], word[e:]) for e in range(2, n + 1)]
+        return lefts, rights, subs
+
+    max_memory, cache_size = _match_budget(max_memory, cache_size)
+    if max_memory:
+        counter = CooccurrenceCounter(max_memory=max_memory, spill_dir=spill_dir)
+        prune_per_sent = 0
+    else:
+        counter = CooccurrenceCounter()
+    cache = {}
+
+    stage = instrument.stage('count', submax=submax)
+
+    i_sent = -1
+    for i_sent, words in enumerate(sentences):
+        if prune_per_sent > 0 and i_sent > 0 and i_sent % prune_per_sent == 0:
+            scanner.prune(prune_min_count)
+            counter.prune(prune_min_count)
+            stage.prune(i_sent, num_subwords=len(scanner.sub_counter),
+                num_features=len(scanner.features), nnz=counter.nnz)
+
+        for word in words:
+            if len(word) > 1:
+                word_counts[word] = word_counts.get(word, 0) + 1
+        matches = _match_words(words, candidates, cache, cache_size)
+
+        n_words = len(words)
+        for i_word in range(n_words):
+            subs = matches[i_word][2]
+            if not subs:
+                continue
+            lefts = matches[i_word-1][0] if i_word > 0 else []
+            rights = matches[i_word+1][1] if i_word < n_words - 1 else []
+            for subword, r in subs:
+                cols = list(lefts)
+                if r:
+                    cols.append((1, r))
+                cols += [(1, r, right) for right in rights]
+                if cols:
+                    counter.add_features(subword, cols)
+
+        if i_sent % flush_per_sent == 0:
+            scanner.flush()
+            stage.progress(i_sent, num_subwords=len(scanner.sub_counter),
+                num_features=len(scanner.features))
+
+    scanner.flush()
+    subwords = scanner.sub_counter.to_dict()
+    features = scanner.features
+    # counter.nnz merges all spilled runs
+    if instrument.enabled:
+        stage.end(i_sent+1, num_subwords=len(subwords), num_features=len(features),
+            nnz=counter.nnz)
+    return subwords, features, counter, i_sent+1
@@ -0,0 +1,180 @@
+class Trie:
+    """
+    Arguments
+    ---------
+    keys : iterable of str
+        Dictionary of strings such as subwords or features
+    reverse : Boolean
+        If True, keys are inserted from their last character, so that
+        suffixes of a word are matched with suffix_lengths. Default is False
+
+    Usage
+    -----
+        trie = Trie({'아이', '아이오아이'})
+        trie.prefix_lengths('아이오아이는', min_len=2)
+        $ [2, 5]
+
+        suffix_trie = Trie({'는', '이는'}, reverse=True)
+        suffix_trie.suffix_lengths('아이오아이는', max_len=5)
+        $ [1, 2]
+
+    Description
+    -----------
+    One walk over the characters of a word returns the lengths of all
+    matched keys, so prefixes and suffixes are not sliced for every length.
+    Each node is a dict from character to child node and the empty string key
+    marks the end of a key. A double-array trie needs two array lookups and a
+    character code lookup for each character, which is slower than one dict
+    lookup in CPython.
+    """
+
+    def __init__(self, keys, reverse=False):
+        self.reverse = reverse
+        self.root = {}
+        self._len = 0
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        node = self.root
+        for c in (reversed(key) if self.reverse else key):
+            child = node.get(c)
+            if child is None:
+                child = node[c] = {}
+            node = child
+        if not ('' in node):
+            node[''] = True
+            self._len += 1
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, key):
+        node = self.root
+        for c in (reversed(key) if self.reverse else key):
+            node = node.get(c)
+            if node is None:
+                return False
+        return '' in node
+
+    def prefix_lengths(self, word, min_len=1, max_len=-1):
+        """
+        It returns list of length i in increasing order of which word[:i] is a key.
+        The trie must not be reversed
+        """
+
+        if max_len > 0:
+            word = word[:max_len]
+        lengths = []
+        node = self.root
+        i = 0
+        for c in word:
+            node = node.get(c)
+            if node is None:
+                break
+            i += 1
+            if '' in node and i >= min_len:
+                lengths.append(i)
+        return lengths
+
+    def suffix_lengths(self, word, min_len=1, max_len=-1):
+        """
+        It returns list of length i in increasing order of which word[-i:] is a key.
+        The trie must be reversed
+        """
+
+        if max_len > 0:
+            word = word[-max_len:]
+        lengths = []
+        node = self.root
+        i = 0
+        for c in reversed(word):
+            node = node.get(c)
+            if node is None:
+                break
+            i += 1
+            if '' in node and i >= min_len:
+                lengths.append(i)
+        return lengths
+
+
+class PrefixCounter:
+    """
+    Arguments
+    ---------
+    min_len : int
+        Minimum length of counted prefixes. Default is 2
+
+    Usage
+    -----
+        counter = PrefixCounter(min_len=2)
+        counter.add('아이오아이는')     # counts 아이, 아이오, ..., 아이오아이는
+        counter.add('아이는', 3)        # counts 아이, 아이는 three times
+        counter.prune(2)
+        subwords = counter.to_dict()
+
+    Description
+    -----------
+    Counts every prefix of length >= min_len of the added words in a trie of
+    [count, children] nodes, so the prefixes are not sliced as strings while
+    counting. They are built once in to_dict. The count of a prefix is never
+    smaller than the counts of its extensions, so prune removes whole subtrees
+    and gives the same result as pruning a dict of prefix counts.
+    """
+
+    def __init__(self, min_len=2):
+        self.min_len = min_len
+        self.root = [0, {}]
+        self._len = 0
+
+    def add(self, word, count=1):
+        if len(word) < self.min_len:
+            return
+        min_len = self.min_len
+        node = self.root
+        for i, c in enumerate(word, 1):
+            children = node[1]
+            child = children.get(c)
+            if child is None:
+                child = children[c] = [0, {}]
+                if i >= min_len:
+                    self._len += 1
+            node = child
+            if i >= min_len:
+                node[0] += count
+
+    def __len__(self):
+        return self._len
+
+    def prune(self, min_count):
+        """Remove prefixes of which count is smaller than min_count"""
+        self._len = self._prune(self.root, 0, min_count)
+
+    def _prune(self, node, depth, min_count):
+        # It returns the number of remained prefixes under node
+        n = 0
+        children = node[1]
+        for c in list(children):
+            child = children[c]
+            if depth + 1 >= self.min_len:
+                if child[0] < min_count:
+                    del children[c]
+                    continue
+                n += 1
+            n += self._prune(child, depth + 1, min_count)
+            if depth + 1 < self.min_len and not child[1]:
+                del children[c]
+        return n
+
+    def to_dict(self, min_count=1):
+        """It returns dict of {prefix: count} of which count is at least min_count"""
+        counts = {}
+        stack = [('', self.root, 0)]
+        while stack:
+            prefix, node, depth = stack.pop()
+            if depth >= self.min_len:
+                if node[0] < min_count:
+                    continue
+                counts[prefix] = node[0]
+            stack += [(prefix + c, child, depth + 1) for c, child in node[1].items()]
+        return counts
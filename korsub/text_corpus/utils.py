@@ -1,36 +1,168 @@
+import numpy as np
+from ..instrument import get_instrument
+from ..utils import line_offsets
+
+
 class Sentences:
-    def __init__(self, path, num_sent=-1, lowercase=True, verbose_point=-1):
+    """
+    Arguments
+    ---------
+    path : str
+        Corpus path. One sentence per line, words are separated by whitespace
+    num_sent : int
+        Maximum number of sent to be yield
+        Default is -1 (use all)
+    begin : int
+        Byte offset where iteration starts. It must be the first byte of a line
+        Default is 0
+    end : int
+        Byte offset where iteration stops. Lines that start at or after end are
+        not yielded. Default is -1 (until end of file)
+    verbose_point : int
+        If positive, progress is reported at every verbose_point lines.
+        Default is -1 (silent)
+    instrument : korsub.instrument.Instrument or None
+        Sink of progress events of stage 'sentences'. If None, PrintInstrument
+        is used when verbose_point is positive. With an instrument and
+        non-positive verbose_point, progress is reported every 10000 lines
+    cache_index : Boolean
+        If True, the line offset index used by len(), indexing and split()
+        is cached as {path}.lines.npy. See korsub.utils.line_offsets
+
+    Usage
+    -----
+        sentences = Sentences(path)
+        for words in sentences:
+            # do something
+
+        # byte-range shards for multiprocessing
+        for shard in sentences.split(4):
+            for words in shard:
+                # do something
+
+        # random access with line offset index
+        len(sentences)
+        sentences[100]          # list of str
+        sentences[100:200]      # Sentences of the lines
+
+    Description
+    -----------
+    Length, indexing and split() use an int64 array of line start offsets.
+    It is built with one vectorized pass over the file and cached next to
+    the corpus, so other processes and later runs load it memory-mapped.
+    Length and indices count all lines including empty lines, while
+    iteration skips empty lines.
+    """
+
+    def __init__(self, path, num_sent=-1, lowercase=True, verbose_point=-1,
+        begin=0, end=-1, instrument=None, cache_index=True):
+
         self.path = path
         self.num_sent = num_sent
         self.lowercase = lowercase
         self.verbose_point = verbose_point
-        self._len = 0
+        self.begin = begin
+        self.end = end
+        self.instrument = instrument
+        self.cache_index = cache_index
+        self._offsets = None
         self._num_iter = 0
 
+    def __getstate__(self):
+        # the index is loaded again from the cache file in other processes
+        state = dict(self.__dict__)
+        state['_offsets'] = None
+        state['instrument'] = None
+        return state
+
+    def _line_range(self):
+        if self._offsets is None:
+            self._offsets = line_offsets(self.path, self.cache_index)
+        offsets = self._offsets
+        b = int(np.searchsorted(offsets[:-1], self.begin))
+        e = offsets.shape[0] - 1
+        if self.end >= 0:
+            e = int(np.searchsorted(offsets[:-1], self.end))
+        if self.num_sent > 0:
+            e = min(e, b + self.num_sent)
+        return offsets, b, e
+
     def __iter__(self):
         vp = self.verbose_point
-        with open(self.path, encoding='utf-8') as f:
-            for i, sent in enumerate(f):
-                if self.num_sent > 0 and i >= self.num_sent:
-                    break
-                if vp > 0 and i % vp == 0:
-                    print('\riter = %d, num sents = %d%s' % (self._num_iter, i, ' '*15), end='')
-                sent = sent.strip()
-                if not sent:
-                    continue
-                yield sent.split()
-            self._len = i + 1
-        if vp > 0:
-            print('\r%d th iterating was done. num sents = %d%s' % (self._num_iter, i+1, ' '*15))
+        instrument = get_instrument(self.instrument, vp > 0)
+        stage = instrument.stage('sentences', num_iter=self._num_iter)
+        if vp <= 0:
+            vp = 10000 if instrument.enabled else -1
+        i = -1
+        for i, sent in enumerate(self._iter_lines()):
+            if self.num_sent > 0 and i >= self.num_sent:
+                break
+            if vp > 0 and i % vp == 0:
+                stage.progress(i, num_iter=self._num_iter)
+            sent = sent.strip()
+            if not sent:
+                continue
+            yield sent.split()
+        stage.end(i+1, num_iter=self._num_iter)
         self._num_iter += 1
 
+    def _iter_lines(self):
+        with open(self.path, 'rb') as f:
+            f.seek(self.begin)
+            pos = self.begin
+            for line in f:
+                if self.end >= 0 and pos >= self.end:
+                    break
+                pos += len(line)
+                yield line.decode('utf-8')
+
     def __len__(self):
-        if self._len == 0:
-            with open(self.path, encoding='utf-8') as f:
-                for i, _ in enumerate(f):
-                    continue
-                self._len = (i+1)
-        return self._len
+        _, b, e = self._line_range()
+        return e - b
+
+    def __getitem__(self, index):
+        offsets, b, e = self._line_range()
+        if isinstance(index, slice):
+            start, stop, step = index.indices(e - b)
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            stop = max(start, stop)
+            return Sentences(self.path, lowercase=self.lowercase,
+                begin=int(offsets[b + start]), end=int(offsets[b + stop]),
+                cache_index=self.cache_index)
+        if index < 0:
+            index += e - b
+        if not (0 <= index < e - b):
+            raise IndexError('Sentences index out of range; {}'.format(index))
+        with open(self.path, 'rb') as f:
+            f.seek(int(offsets[b + index]))
+            line = f.read(int(offsets[b + index + 1] - offsets[b + index]))
+        return line.decode('utf-8').split()
 
     def reset_num_iter(self):
-        self._num_iter = 0
\ No newline at end of file
+        self._num_iter = 0
+
+    def split(self, n_shards):
+        """
+        Arguments
+        ---------
+        n_shards : int
+            Number of shards
+
+        Returns
+        -------
+        shards : list of Sentences
+            Byte-range shards of (almost) equal size. Shard boundaries are
+            aligned to the beginning of lines with the line offset index,
+            so every line belongs to exactly one shard. Empty shards are removed.
+        """
+
+        offsets, b, e = self._line_range()
+        begin, end = int(offsets[b]), int(offsets[e])
+        targets = begin + (end - begin) * np.arange(1, n_shards) // n_shards
+        # the first line start at or after each target
+        bounds = offsets[np.searchsorted(offsets[b:e+1], targets) + b].tolist()
+        bounds = [begin] + bounds + [end]
+        return [Sentences(self.path, lowercase=self.lowercase, begin=bb, end=ee,
+                          cache_index=self.cache_index)
+                for bb, ee in zip(bounds, bounds[1:]) if bb < ee]
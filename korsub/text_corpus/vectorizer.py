@@ -1,27 +1,133 @@
 from collections import defaultdict
-from ..utils import get_process_memory
+from ..cooccurrence import CooccurrenceCounter
+from ..instrument import get_instrument
+from ..sketch import SpaceSaving
+from .trie import PrefixCounter
+from .trie import Trie
 
 def scan_subwords(sentences, submax=5, min_count=10,
-    prune_per_sent=2000000, prune_min_count=2, verbose=True):
+    prune_per_sent=2000000, prune_min_count=2, verbose=True, n_jobs=1,
+    max_memory=None, return_error=False, instrument=None):
+    """
+    Arguments
+    ---------
+    sentences : Sentences or iterable of list of str
+        Whitespace tokenized sentences
+    submax : int
+        Maximum length of features
+    min_count : int
+        Minimum occurrence of subword
+    prune_per_sent : int
+        Subwords and features of which count is smaller than prune_min_count
+        are removed at every prune_per_sent sentences
+    prune_min_count : int
+        Minimum count used when pruning
+    verbose : Boolean
+        If True, it shows progress
+    n_jobs : int
+        Number of processes. If n_jobs > 1, sentences must be Sentences.
+        The file is split into n_jobs byte-range shards, each shard is counted
+        in a worker process and the partial counters are merged.
+        Pruning is applied to each shard independently, so the result is
+        identical to single process counting when no shard reaches prune_per_sent
+    max_memory : float or None
+        Memory budget of counters in MB. If it is set, subwords and features
+        are counted with korsub.sketch.SpaceSaving sketches of fixed size
+        instead of pruning, and prune_per_sent is ignored. Each estimated
+        count differs from the true count at most the reported error.
+        With n_jobs > 1, the budget is divided among the workers
+    return_error : Boolean
+        If True, it also returns the maximum count errors of subwords and
+        features. They are 0 without max_memory
+    instrument : korsub.instrument.Instrument or None
+        Sink of progress and prune events of stage 'scan_subwords'.
+        If None, PrintInstrument is used when verbose is True
+
+    Returns
+    -------
+    subwords : dict
+        subword counter
+    features : dict
+        feature counter
+    errors : tuple of int
+        (subword error, feature error). Only returned when return_error is True
+    """
+
+    instrument = get_instrument(instrument, verbose)
+    if n_jobs > 1:
+        from multiprocessing import Pool
+        shards = _split_sentences(sentences, n_jobs)
+        stage = instrument.stage('scan_subwords', n_jobs=len(shards))
+        shard_memory = max_memory / len(shards) if max_memory else None
+        args = [(shard, submax, prune_per_sent, prune_min_count, shard_memory)
+                for shard in shards]
+        with Pool(n_jobs) as pool:
+            results = pool.map(_scan_subwords_worker, args)
+        subwords = _merge_counters([r[0] for r in results])
+        features = _merge_counters([r[1] for r in results])
+        errors = (sum(r[2][0] for r in results), sum(r[2][1] for r in results))
+        if max_memory:
+            subwords, sub_error = _shrink(subwords, max_memory / 2)
+            features, feature_error = _shrink(features, max_memory / 2)
+            errors = (errors[0] + sub_error, errors[1] + feature_error)
+        subwords = {k:v for k,v in subwords.items() if v >= min_count}
+        stage.end(sum(r[3] for r in results), num_subwords=len(subwords),
+            num_features=len(features), sub_error=errors[0], feature_error=errors[1])
+    else:
+        subwords, features, errors, _ = _scan_subwords(sentences, submax, min_count,
+            prune_per_sent, prune_min_count, instrument, max_memory)
+
+    if return_error:
+        return subwords, features, errors
+    return subwords, features
+
+def _scan_subwords_worker(args):
+    shard, submax, prune_per_sent, prune_min_count, max_memory = args
+    return _scan_subwords(shard, submax, 0, prune_per_sent,
+        prune_min_count, get_instrument(), max_memory)
+
+def _split_sentences(sentences, n_jobs):
+    if not hasattr(sentences, 'split'):
+        raise ValueError('n_jobs > 1 requires korsub.text_corpus.Sentences')
+    return sentences.split(n_jobs)
+
+def _merge_counters(counters):
+    merged = defaultdict(int)
+    for counter in counters:
+        for k, v in counter.items():
+            merged[k] += v
+    return dict(merged)
+
+def _shrink(counter, max_memory):
+    sketch = SpaceSaving.from_memory(max_memory)
+    if len(counter) <= sketch.capacity:
+        return counter, 0
+    sketch.counts = counter
+    sketch.shrink()
+    return sketch.counts, sketch.floor
+
+def _scan_subwords(sentences, submax, min_count,
+    prune_per_sent, prune_min_count, instrument, max_memory=None):
+
+    if not max_memory:
+        return _scan_subwords_exact(sentences, submax, min_count,
+            prune_per_sent, prune_min_count, instrument)
+
+    # half of the budget for each counter
+    sub_sketch = SpaceSaving.from_memory(max_memory / 2)
+    feature_sketch = SpaceSaving.from_memory(max_memory / 2)
 
     subwords = {}
     features = {}
+    # new items start from floor count
+    sub_floor = 0
+    feature_floor = 0
 
     prune = lambda d, m:{k:v for k,v in d.items() if v >= m}
-    num_subwords = lambda: len(subwords)
-    num_features = lambda: len(features)
-
-    def status(i_sent, newline=False):
-        form = '\rscan {} subwords, {} features, from {} sents, mem = {:.3} GB{}'
-        message = form.format(
-            num_subwords(), num_features(), i_sent, get_process_memory(), ' '*20)
-        print(message, end='\n' if newline else '')
+    stage = instrument.stage('scan_subwords', submax=submax)
 
+    i_sent = -1
     for i_sent, words in enumerate(sentences):
-        if prune_per_sent > 0 and i_sent % prune_per_sent == 0:
-            features = prune(features, prune_min_count)
-            subwords = prune(subwords, prune_min_count)
-
         for word in words:
             n = len(word)
             if n <= 1:
@@ -30,21 +136,122 @@ def scan_subwords(sentences, submax=5, min_count=10,
                 l = word[:i] if i <= submax else None
                 r = word[i:] if (n - i) < submax else None
                 if l is not None:
-                    features[l] = features.get(l, 0) + 1
+                    features[l] = features.get(l, feature_floor) + 1
                 if r is not None:
-                    features[r] = features.get(r, 0) + 1
+                    features[r] = features.get(r, feature_floor) + 1
             for i in range(2, n + 1):
                 sub = word[:i]
-                subwords[sub] = subwords.get(sub, 0) + 1
+                subwords[sub] = subwords.get(sub, sub_floor) + 1
 
-        if verbose and i_sent % 10000 == 0:
-            status(i_sent)
+        if len(subwords) > sub_sketch.capacity:
+            sub_sketch.counts = subwords
+            sub_sketch.shrink()
+            subwords, sub_floor = sub_sketch.counts, sub_sketch.floor
+            stage.prune(i_sent, num_subwords=len(subwords), sub_error=sub_floor)
+        if len(features) > feature_sketch.capacity:
+            feature_sketch.counts = features
+            feature_sketch.shrink()
+            features, feature_floor = feature_sketch.counts, feature_sketch.floor
+            stage.prune(i_sent, num_features=len(features), feature_error=feature_floor)
+
+        if i_sent % 10000 == 0:
+            stage.progress(i_sent, num_subwords=len(subwords), num_features=len(features))
 
     subwords = prune(subwords, min_count)
-    if verbose:
-        status(i_sent+1, newline=True)
+    stage.end(i_sent+1, num_subwords=len(subwords), num_features=len(features),
+        sub_error=sub_floor, feature_error=feature_floor)
 
-    return subwords, features
+    return subwords, features, (sub_floor, feature_floor), i_sent+1
+
+def _scan_subwords_exact(sentences, submax, min_count,
+    prune_per_sent, prune_min_count, instrument, flush_per_sent=10000):
+
+    scanner = _WordScanner(submax)
+    word_counts = scanner.word_counts
+    stage = instrument.stage('scan_subwords', submax=submax)
+
+    i_sent = -1
+    for i_sent, words in enumerate(sentences):
+        if prune_per_sent > 0 and i_sent > 0 and i_sent % prune_per_sent == 0:
+            scanner.prune(prune_min_count)
+            stage.prune(i_sent, num_subwords=len(scanner.sub_counter),
+                num_features=len(scanner.features))
+
+        for word in words:
+            if len(word) > 1:
+                word_counts[word] = word_counts.get(word, 0) + 1
+
+        if i_sent % flush_per_sent == 0:
+            scanner.flush()
+            stage.progress(i_sent, num_subwords=len(scanner.sub_counter),
+                num_features=len(scanner.features))
+
+    scanner.flush()
+    subwords = scanner.sub_counter.to_dict(min_count)
+    features = scanner.features
+    stage.end(i_sent+1, num_subwords=len(subwords), num_features=len(features),
+        sub_error=0, feature_error=0)
+
+    return subwords, features, (0, 0), i_sent+1
+
+class _WordScanner:
+    """
+    Subword and feature counts of scan_subwords. Words are counted first in
+    word_counts and their subwords and features are counted once per distinct
+    word with the word count at flush() and before pruning, so the result is
+    same with counting every token. Subwords are counted in a prefix trie
+    without slicing.
+    """
+
+    def __init__(self, submax):
+        self.submax = submax
+        self.sub_counter = PrefixCounter(min_len=2)
+        self.features = {}
+        self.word_counts = {}
+
+    def flush(self):
+        submax = self.submax
+        features = self.features
+        for word, count in self.word_counts.items():
+            n = len(word)
+            for i in range(2, min(n, submax) + 1):
+                l = word[:i]
+                features[l] = features.get(l, 0) + count
+            for i in range(max(2, n - submax + 1), n + 1):
+                r = word[i:]
+                features[r] = features.get(r, 0) + count
+            self.sub_counter.add(word, count)
+        self.word_counts.clear()
+
+    def prune(self, min_count):
+        self.flush()
+        self.features = {k:v for k,v in self.features.items() if v >= min_count}
+        self.sub_counter.prune(min_count)
+
+# approximate bytes of a cached match of a word
+_MATCH_BYTES = 2048
+
+def _match_budget(max_memory, cache_size):
+    """
+    It returns max_memory of the counter and the number of cached matches.
+    With max_memory, the cache takes at most a quarter of the budget
+    """
+    if not max_memory:
+        return max_memory, cache_size
+    cache_size = max(1, min(cache_size, int(max_memory * 1024 ** 2 / 4 / _MATCH_BYTES)))
+    return max_memory - cache_size * _MATCH_BYTES / 1024 ** 2, cache_size
+
+def _match_words(words, match, cache, cache_size):
+    # matches of frequent words are reused
+    matches = []
+    for word in words:
+        m = cache.get(word)
+        if m is None:
+            if len(cache) >= cache_size:
+                cache.clear()
+            m = cache[word] = match(word)
+        matches.append(m)
+    return matches
 
 def enumerate_r_parts(word, submax, dic):
     for i in range(1, min(submax, len(word)) + 1):
@@ -65,54 +272,204 @@ def prune(C, min_count):
     return C
 
 def subword_features(sentences, subwords, subfeatures, min_count=2,
-    prune_per_sent=1000000, prune_min_count=2, verbose=True):
+    prune_per_sent=1000000, prune_min_count=2, verbose=True, n_jobs=1,
+    backend='dict', instrument=None, max_memory=None, spill_dir=None):
+    """
+    Arguments
+    ---------
+    sentences : Sentences or iterable of list of str
+        Whitespace tokenized sentences
+    subwords : set or dict of str
+        Dictionary of subwords
+    subfeatures : set or dict of str
+        Dictionary of features
+    min_count : int
+        Minimum co-occurrence of (subword, feature)
+    prune_per_sent : int
+        (subword, feature) pairs of which count is smaller than prune_min_count
+        are removed at every prune_per_sent sentences
+    prune_min_count : int
+        Minimum count used when pruning
+    verbose : Boolean
+        If True, it shows progress
+    n_jobs : int
+        Number of processes. If n_jobs > 1, sentences must be Sentences.
+        See scan_subwords for the details of sharding
+    backend : str
+        'dict' counts with nested dict.
+        'array' counts with korsub.cooccurrence.CooccurrenceCounter, which
+        interns subwords and features to int ids and uses far less memory
+    instrument : korsub.instrument.Instrument or None
+        Sink of progress and prune events of stage 'subword_features'.
+        If None, PrintInstrument is used when verbose is True
+    max_memory : float or None
+        Memory budget (MB) of the counts. If it is set, the counts are exact;
+        pruning is disabled and the counts are spilled to sorted run files
+        on disk when they reach the budget. With n_jobs > 1, each process has
+        max_memory / n_jobs. Up to a quarter of the budget is used by the cache
+        of per-word matches. See korsub.cooccurrence.CooccurrenceCounter
+    spill_dir : str or None
+        Directory of the run files. Default is the system temporary directory
+
+    Returns
+    -------
+    C : dict of dict or CooccurrenceCounter
+        C[subword][(direction, feature)] = count.
+        With backend='array', it returns CooccurrenceCounter. Use C.to_dict()
+        for nested dict or c_to_x(C) for sparse matrix
+    """
+
+    instrument = get_instrument(instrument, verbose)
+    if n_jobs > 1:
+        from multiprocessing import Pool
+        shards = _split_sentences(sentences, n_jobs)
+        stage = instrument.stage('subword_features', n_jobs=len(shards))
+        shard_memory = max_memory / len(shards) if max_memory else None
+        args = [(shard, subwords, subfeatures, prune_per_sent, prune_min_count,
+                 backend, shard_memory, spill_dir) for shard in shards]
+        if max_memory or backend == 'array':
+            C = CooccurrenceCounter(max_memory=max_memory, spill_dir=spill_dir)
+        else:
+            C = defaultdict(lambda: defaultdict(int))
+        n_sents = 0
+        # each result is merged and discarded as it arrives
+        with Pool(n_jobs) as pool:
+            for C_, n in pool.imap(_subword_features_worker, args):
+                n_sents += n
+                if max_memory:
+                    # run files of the worker are merged block by block
+                    C.update_runs(*C_)
+                elif backend == 'array':
+                    C.update(C_)
+                else:
+                    for k1, d in C_.items():
+                        Ck1 = C[k1]
+                        for k2, v in d.items():
+                            Ck1[k2] += v
+                del C_
+        if max_memory or backend == 'array':
+            C.prune(min_count)
+            if backend == 'dict':
+                C = C.to_dict()
+        else:
+            C = {k1:{k2:v for k2, v in d.items() if v >= min_count} for k1, d in C.items()}
+            C = {k1:d for k1, d in C.items() if d}
+        if instrument.enabled:
+            stage.end(n_sents, num_subwords=len(C))
+        return C
+
+    return _subword_features(sentences, subwords, subfeatures, min_count,
+        prune_per_sent, prune_min_count, instrument, backend, max_memory, spill_dir)[0]
+
+def _subword_features_worker(args):
+    (shard, subwords, subfeatures, prune_per_sent, prune_min_count,
+     backend, max_memory, spill_dir) = args
+    # counters of workers are merged in the main process
+    if max_memory:
+        backend = 'array'
+    C, n_sents = _subword_features(shard, subwords, subfeatures, 1,
+        prune_per_sent, prune_min_count, get_instrument(), backend, max_memory, spill_dir)
+    if max_memory:
+        # only the paths of spilled runs are sent, not the counts
+        return C.export_runs(), n_sents
+    return C, n_sents
+
+def _subword_features(sentences, subwords, subfeatures, min_count,
+    prune_per_sent, prune_min_count, instrument, backend, max_memory=None,
+    spill_dir=None, cache_size=100000):
+
+    if not (backend in ('array', 'dict')):
+        raise ValueError("backend must be 'dict' or 'array'; got {}".format(backend))
+    max_memory, cache_size = _match_budget(max_memory, cache_size)
+    if max_memory:
+        counter = CooccurrenceCounter(max_memory=max_memory, spill_dir=spill_dir)
+        prune_per_sent = 0
+    elif backend == 'array':
+        counter = CooccurrenceCounter()
+    else:
+        counter = None
+        C = defaultdict(lambda: defaultdict(int))
+
+    stage = instrument.stage('subword_features', backend=backend)
 
-    C = defaultdict(lambda: defaultdict(int))
+    # matches of each word are found with one walk over its characters
+    sub_trie = Trie(subwords)
+    l_part_trie = Trie(subfeatures)
+    r_part_trie = Trie(subfeatures, reverse=True)
 
+    def match(word):
+        # leftside features of the right neighbor, enumerate_r_parts
+        lefts = [(0, word[-i:]) for i in r_part_trie.suffix_lengths(word, 1, 5)]
+        # rightside features of the left neighbor, enumerate_l_parts
+        rights = [word[:i] for i in l_part_trie.prefix_lengths(word, 2, 5)]
+        # (subword, r) of which r is None if it is not included in subfeatures
+        subs = []
+        n = len(word)
+        if n > 1:
+            r_lens = set(r_part_trie.suffix_lengths(word, 1, n - 2)) if n > 2 else ()
+            for e_sub in sub_trie.prefix_lengths(word, 2):
+                r = word[e_sub:]
+                subs.append((word[:e_sub], r if (not r or (n - e_sub) in r_lens) else None))
+        return lefts, rights, subs
+
+    cache = {}
+
+    i_sent = -1
     for i_sent, words in enumerate(sentences):
-        if i_sent % prune_per_sent == 0:
-            C = prune(C, prune_min_count)
+        if prune_per_sent > 0 and i_sent > 0 and i_sent % prune_per_sent == 0:
+            if counter is None:
+                C = prune(C, prune_min_count)
+                stage.prune(i_sent, num_subwords=len(C))
+            else:
+                counter.prune(prune_min_count)
+                stage.prune(i_sent, nnz=counter.nnz)
 
-        if verbose and i_sent % 10000 == 0:
-            print('\rcounting co-occurrence from {} sents, mem={:.3} Gb{}'.format(
-                i_sent, get_process_memory(), ' '*5), end='')
+        if i_sent % 10000 == 0:
+            stage.progress(i_sent)
 
         n_words = len(words)
+        matches = _match_words(words, match, cache, cache_size)
 
-        for i_word, word in enumerate(words):
-
-            n = len(word)
-            if n == 1:
+        for i_word in range(n_words):
+            subs = matches[i_word][2]
+            if not subs:
                 continue
 
-            for e_sub in range(2, n + 1):
-                subword = word[:e_sub]
-                if not (subword in subwords):
-                    continue
+            # leftside features are shared by all subwords of the word
+            lefts = matches[i_word-1][0] if i_word > 0 else []
+            rights = matches[i_word+1][1] if i_word < n_words - 1 else []
 
-                # leftside features
-                if i_word > 0:
-                    for left in enumerate_r_parts(words[i_word-1], 5, subfeatures):
-                        C[subword][(0, left)] += 1
+            for subword, r in subs:
+                features = list(lefts)
 
-                r = word[e_sub:]
-                if r and not (r in subfeatures):
-                    continue
+                if r is not None:
+                    # r features
+                    if r:
+                        features.append((1, r))
+
+                    # rightside features
+                    features += [(1, r + right) for right in rights]
 
-                # r features
-                if r:
-                    C[subword][(1, r)] += 1
+                if not features:
+                    continue
 
-                # rightside features
-                if i_word < n_words - 1:
-                    for right in enumerate_l_parts(words[i_word+1], 5, subfeatures):
-                        C[subword][(1, r + right)] += 1
+                if counter is None:
+                    Cs = C[subword]
+                    for feature in features:
+                        Cs[feature] += 1
+                else:
+                    counter.add_features(subword, features)
 
-    C = {k1:{k2:v for k2, v in d.items() if v >= min_count} for k1, d in C.items()}
-    C = {k1:d for k1, d in C.items() if d}
+    if counter is None:
+        C = {k1:{k2:v for k2, v in d.items() if v >= min_count} for k1, d in C.items()}
+        C = {k1:d for k1, d in C.items() if d}
+    else:
+        if min_count > 1:
+            counter.prune(min_count)
+        C = counter if backend == 'array' else counter.to_dict()
 
-    if verbose:
-        print('\rcounting co-occurrence from {} sents was done. mem={:.3} Gb{}'.format(
-            i_sent, get_process_memory(), ' '*5))
+    # len(counter) merges all spilled runs
+    if instrument.enabled:
+        stage.end(i_sent+1, num_subwords=len(C))
 
-    return C
+    return C, i_sent+1
@@ -1,8 +1,8 @@
-from collections import defaultdict
+from itertools import chain
+import json
 import os
-import psutil
-from sklearn.metrics import pairwise_distances
-from scipy.sparse import csr_matrix
+import tempfile
+import numpy as np
 
 
 def most_similar(query, wv, vocab_to_idx, idx_to_vocab, topk=10):
@@ -23,45 +23,306 @@ def most_similar(query, wv, vocab_to_idx, idx_to_vocab, topk=10):
     similars : list of tuple
         List contains tuples (word, cosine similarity)
         Its length is topk
+
+    For repeated queries, use korsub.similarity.SimilarityIndex which
+    normalizes the vectors once.
     """
 
+    from sklearn.metrics import pairwise_distances
+
     q = vocab_to_idx.get(query, -1)
     if q == -1:
         return []
     qvec = wv[q].reshape(1,-1)
     dist = pairwise_distances(qvec, wv, metric='cosine')[0]
-    sim_idxs = dist.argsort()
-    if topk > 0:
-        sim_idxs = sim_idxs[:topk+1]
+    if 0 < topk < dist.shape[0] - 1:
+        # partial sort of topk + 1 candidates including the query itself
+        sim_idxs = np.argpartition(dist, topk)[:topk+1]
+        sim_idxs = sim_idxs[dist[sim_idxs].argsort()]
+    else:
+        sim_idxs = dist.argsort()
     similars = [(idx_to_vocab[idx], 1 - dist[idx]) for idx in sim_idxs if idx != q]
     return similars
 
+_process = None
+
 def get_process_memory():
-    """It returns the memory usage of current process"""
-    
-    process = psutil.Process(os.getpid())
-    return process.memory_info().rss / (1024 ** 3)
-
-def c_to_x(C):
-    row_counter = {}
-    col_counter = defaultdict(int)
-    for r, d in C.items():
-        row_counter[r] = sum(d.values())
-        for c, v in d.items():
-            col_counter[c] += v
-    idx_to_row = [r for r in sorted(row_counter, key=lambda x:-row_counter[x])]
-    idx_to_col = [c for c in sorted(col_counter, key=lambda x:-col_counter[x])]
-    row_to_idx = {r:idx for idx, r in enumerate(idx_to_row)}
-    col_to_idx = {c:idx for idx, c in enumerate(idx_to_col)}
+    """It returns the memory usage (GB) of current process"""
+    global _process
+    if _process is None or _process.pid != os.getpid():
+        import psutil
+        _process = psutil.Process(os.getpid())
+    return _process.memory_info().rss / (1024 ** 3)
+
+def c_to_x(C, dtype=np.int64):
+    """
+    :param C: dict of dict or korsub.cooccurrence.CooccurrenceCounter
+        C[row][column] = count
+    :param dtype: numpy.dtype
+        Data type of X. Default is numpy.int64. numpy.int32 halves the memory
+        of X, but counts and their sums must be smaller than 2**31
+    It returns
+    ----------
+    X : scipy.sparse.csr_matrix
+        (row, column) count matrix
+    idx_to_row : list
+        Mapper from index to row value. Sorted by frequency
+    idx_to_col : list
+        Mapper from index to column value. Sorted by frequency
+    """
+
+    if hasattr(C, 'to_csr'):
+        return C.to_csr(dtype=dtype)
+    return blocks_to_x([C], dtype)
 
+def blocks_to_x(blocks, dtype=np.int64):
+    """
+    :param blocks: iterable of dict of dict
+        Partial count blocks, C[row][column] = count. Counts of same
+        (row, column) in different blocks are summed. It can be a generator,
+        so that each block is converted to arrays while the next block is counted
+    :param dtype: numpy.dtype
+        Data type of X. Default is numpy.int64. numpy.int32 halves the memory
+        of X, but counts and their sums must be smaller than 2**31
+    It returns
+    ----------
+    X, idx_to_row, idx_to_col : same with c_to_x
+
+    Rows and columns are interned in order of first appearance and nonzeros are
+    filled into typed arrays without intermediate Python lists.
+    """
+
+    row_to_idx = {}
+    col_to_idx = {}
     rows, cols, data = [], [], []
-    for r, d in C.items():
-        i = row_to_idx[r]
-        for c, v in d.items():
-            j = col_to_idx[c]
-            rows.append(i)
-            cols.append(j)
-            data.append(v)
-
-    X = csr_matrix((data, (rows, cols)))
-    return X, idx_to_row, idx_to_col
\ No newline at end of file
+
+    for C in blocks:
+        if not isinstance(C, dict):
+            C = dict(C.items())
+        # intern unique values only. The per-nonzero loops run in C
+        for r in C:
+            row_to_idx.setdefault(r, len(row_to_idx))
+        for c in dict.fromkeys(chain.from_iterable(C.values())):
+            col_to_idx.setdefault(c, len(col_to_idx))
+
+        n = sum(map(len, C.values()))
+        row_ids = np.fromiter(map(row_to_idx.__getitem__, C), dtype=np.int32, count=len(C))
+        row_lens = np.fromiter(map(len, C.values()), dtype=np.int64, count=len(C))
+        rows.append(np.repeat(row_ids, row_lens))
+        cols.append(np.fromiter(map(col_to_idx.__getitem__, chain.from_iterable(C.values())),
+            dtype=np.int32, count=n))
+        data.append(np.fromiter(chain.from_iterable(map(dict.values, C.values())),
+            dtype=dtype, count=n))
+
+    idx_to_row = list(row_to_idx)
+    idx_to_col = list(col_to_idx)
+    return frequency_ordered_csr(
+        np.concatenate(rows) if rows else np.zeros(0, dtype=np.int32),
+        np.concatenate(cols) if cols else np.zeros(0, dtype=np.int32),
+        np.concatenate(data) if data else np.zeros(0, dtype=dtype),
+        idx_to_row, idx_to_col)
+
+def frequency_ordered_csr(rows, cols, data, idx_to_row, idx_to_col):
+    """
+    :param rows: numpy.ndarray
+        Row ids of nonzeros
+    :param cols: numpy.ndarray
+        Column ids of nonzeros
+    :param data: numpy.ndarray
+        Values of nonzeros. Duplicated (row, column) are summed
+    :param idx_to_row: list
+        Mapper from row id to row value
+    :param idx_to_col: list
+        Mapper from column id to column value
+    It returns
+    ----------
+    X, idx_to_row, idx_to_col : same with c_to_x
+
+    Rows and columns are re-indexed in decreasing order of their sum.
+    Ties keep the order of ids. Rows and columns of which sum is zero are removed.
+    """
+
+    from scipy.sparse import csr_matrix
+
+    row_sum = np.bincount(rows, weights=data, minlength=len(idx_to_row))
+    col_sum = np.bincount(cols, weights=data, minlength=len(idx_to_col))
+    row_order = np.argsort(-row_sum, kind='stable')[:int((row_sum > 0).sum())]
+    col_order = np.argsort(-col_sum, kind='stable')[:int((col_sum > 0).sum())]
+    n_rows, n_cols = row_order.shape[0], col_order.shape[0]
+
+    row_rank = np.full(len(idx_to_row), -1, dtype=np.int64)
+    row_rank[row_order] = np.arange(n_rows)
+    col_rank = np.full(len(idx_to_col), -1, dtype=np.int64)
+    col_rank[col_order] = np.arange(n_cols)
+
+    keys = row_rank[rows] * max(n_cols, 1) + col_rank[cols]
+    valid = (data != 0) & (keys >= 0)
+    keys, data = keys[valid], data[valid]
+    order = np.argsort(keys, kind='stable')
+    keys, data = keys[order], data[order]
+
+    # sum duplicated (row, column)
+    if keys.shape[0] > 1 and (keys[1:] == keys[:-1]).any():
+        starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+        data = np.add.reduceat(data, starts, dtype=data.dtype)
+        keys = keys[starts]
+
+    index_dtype = np.int32 if max(n_rows, n_cols, keys.shape[0]) < 2 ** 31 else np.int64
+    indices = (keys % max(n_cols, 1)).astype(index_dtype)
+    indptr = np.zeros(n_rows + 1, dtype=index_dtype)
+    np.cumsum(np.bincount(keys // max(n_cols, 1), minlength=n_rows), out=indptr[1:])
+
+    X = csr_matrix((data, indices, indptr), shape=(n_rows, n_cols))
+    idx_to_row = [idx_to_row[i] for i in row_order.tolist()]
+    idx_to_col = [idx_to_col[j] for j in col_order.tolist()]
+    return X, idx_to_row, idx_to_col
+
+def write_vocab(path, idx_to_vocab):
+    """Write vocabs one json per line. Tuple vocab such as ('컬렉션', 'L') is written as list"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for vocab in idx_to_vocab:
+            f.write('{}\n'.format(json.dumps(vocab, ensure_ascii=False)))
+
+def read_vocab(path):
+    """Read vocabs written by write_vocab. List vocab is restored to tuple"""
+    def as_tuple(v):
+        return tuple(as_tuple(e) for e in v) if isinstance(v, list) else v
+    with open(path, encoding='utf-8') as f:
+        return [as_tuple(json.loads(line)) for line in f]
+
+def save_csr(path, name, X):
+    """Save csr matrix as {path}/{name}_data.npy, _indices.npy, _indptr.npy and _shape.npy"""
+    from scipy.sparse import csr_matrix
+
+    X = csr_matrix(X)
+    np.save('{}/{}_data.npy'.format(path, name), X.data)
+    np.save('{}/{}_indices.npy'.format(path, name), X.indices)
+    np.save('{}/{}_indptr.npy'.format(path, name), X.indptr)
+    np.save('{}/{}_shape.npy'.format(path, name), np.asarray(X.shape, dtype=np.int64))
+
+def load_csr(path, name, mmap_mode=None):
+    """Load csr matrix saved by save_csr. With mmap_mode='r', the arrays are memory-mapped"""
+    from scipy.sparse import csr_matrix
+
+    data = np.load('{}/{}_data.npy'.format(path, name), mmap_mode=mmap_mode)
+    indices = np.load('{}/{}_indices.npy'.format(path, name), mmap_mode=mmap_mode)
+    indptr = np.load('{}/{}_indptr.npy'.format(path, name), mmap_mode=mmap_mode)
+    shape = tuple(np.load('{}/{}_shape.npy'.format(path, name)).tolist())
+    return csr_matrix((data, indices, indptr), shape=shape, copy=False)
+
+def line_offsets(path, cache=True):
+    """
+    :param path: str
+        Text file path
+    :param cache: Boolean
+        If True, the index is saved as {path}.lines.npy and reused while the
+        size and modification time of the file are not changed
+    It returns
+    ----------
+    offsets : numpy.ndarray
+        int64, shape = (n_lines + 1,). Line i is bytes [offsets[i], offsets[i+1]).
+        The last value is the file size. Cached index is memory-mapped
+    """
+
+    return _load_offsets(path, 'lines', cache)
+
+def sentence_offsets(path, cache=True):
+    """
+    :param path: str
+        Text file path of which sentences are separated by blank lines,
+        such as FourColumnCorpus
+    :param cache: Boolean
+        If True, the index is saved as {path}.sents.npy. See line_offsets
+    It returns
+    ----------
+    offsets : numpy.ndarray
+        int64, shape = (n_sents + 1,). Sentence i is bytes [offsets[i], offsets[i+1]),
+        which begins with a non-blank line and includes the following blank lines.
+        Consecutive blank lines do not make empty sentences
+    """
+
+    return _load_offsets(path, 'sents', cache)
+
+def _load_offsets(path, kind, cache):
+    stat = os.stat(path)
+    stamp = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    index_path = '{}.{}.npy'.format(path, kind)
+    stamp_path = '{}.{}.json'.format(path, kind)
+    if cache:
+        try:
+            with open(stamp_path, encoding='utf-8') as f:
+                matched = json.load(f) == stamp
+            if matched:
+                offsets = np.load(index_path, mmap_mode='r')
+                if offsets.ndim == 1 and offsets.shape[0] > 0 and offsets[-1] == stat.st_size:
+                    return offsets
+        except (OSError, ValueError, EOFError):
+            # missing or broken index is rebuilt
+            pass
+
+    line_starts, nonblank = _scan_lines(path)
+    if kind == 'lines':
+        offsets = np.append(line_starts, stat.st_size)
+    else:
+        first = nonblank & np.concatenate([[True], ~nonblank[:-1]])
+        offsets = np.append(line_starts[first], stat.st_size)
+
+    if cache:
+        # written to temporary files and renamed, so other processes never map
+        # a partial index. The index is replaced before its stamp
+        try:
+            _replace_file(index_path, lambda f: np.save(f, offsets))
+            _replace_file(stamp_path, lambda f: f.write(json.dumps(stamp).encode('utf-8')))
+        except OSError:
+            # read-only directory. the index is kept in memory only
+            pass
+    return offsets
+
+def _replace_file(path, write):
+    # call write(binary file) on a temporary file in same directory and rename it to path
+    fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def _scan_lines(path, chunk_size=1<<24):
+    # It returns line starts and whether each line has a non-whitespace byte
+    whitespaces = np.zeros(256, dtype=bool)
+    whitespaces[[9, 10, 11, 12, 13, 32]] = True
+    starts, flags = [np.zeros(1, dtype=np.int64)], []
+    base = 0
+    carry = False
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            arr = np.frombuffer(chunk, dtype=np.uint8)
+            newlines = np.flatnonzero(arr == 10)
+            nonspaces = np.flatnonzero(~whitespaces[arr])
+            if newlines.shape[0] > 0:
+                # number of non-whitespace bytes of each line ended in this chunk
+                n = np.diff(np.searchsorted(nonspaces, newlines), prepend=0)
+                n[0] += carry
+                flags.append(n > 0)
+                starts.append(newlines.astype(np.int64) + (base + 1))
+                carry = bool(nonspaces.shape[0] > 0 and nonspaces[-1] > newlines[-1])
+            else:
+                carry = carry or nonspaces.shape[0] > 0
+            base += arr.shape[0]
+    starts = np.concatenate(starts)
+    if starts[-1] == base:
+        # file ends with newline
+        starts = starts[:-1]
+    else:
+        flags.append(np.asarray([carry]))
+    flags = np.concatenate(flags) if flags else np.zeros(0, dtype=bool)
+    return starts, flags
@@ -1,3 +1,6 @@
 from .lr_surface import load_lr_surface_9tags
 from .lr_surface import load_lr_surface_noun
+from .lr_surface import lr_surface_9tags
+from .lr_surface import lr_surface_noun
+from .lr_surface import LRSurfaceDataset
 from .utils import installpath
\ No newline at end of file
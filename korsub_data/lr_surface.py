@@ -1,6 +1,218 @@
+import json
+import os
 import pickle
+import shutil
+import tempfile
+import numpy as np
 from .utils import installpath
 
+_datasets = {}
+
+class LRSurfaceDataset:
+    """
+    Arguments
+    ---------
+    dirname : str
+        Dataset directory which contains params.pkl
+    mmap : Boolean
+        If True, X is stored once as .npy arrays in `dirname`/cache and
+        memory-mapped afterwards. Default is True
+    ltag_type : type
+        Type of the lines of idx_to_ltag.txt. LR_surface_noun has int labels
+        1 and -1. Default is str
+
+    Usage
+    -----
+        data = lr_surface_9tags()
+        data.idx_to_ltag      # loads only idx_to_ltag.txt
+        data.r_to_idx['은']   # built from idx_to_r.txt
+        data.X                # memory-mapped csr_matrix
+
+    Description
+    -----------
+    Each component is loaded on first access and kept in the object, so the
+    components are shared by every caller in a process. `idx_to_r` and
+    `idx_to_ltag` are read from the text files shipped with the dataset, so
+    the lookups of them do not unpickle params.pkl. The first unpickle of
+    params.pkl writes X as .npy arrays and idx_to_l and idx_to_lmorph as JSON
+    lines into `cache` directory, and later loads read the cache, so params.pkl is
+    unpickled at most once per process, and only once at all when the
+    directory is writable. The cache is stamped with the size and modification
+    time of params.pkl and is rebuilt when params.pkl changes.
+
+    With mmap, the arrays of X are read-only memory maps. Copy X before
+    modifying it in place.
+    """
+
+    def __init__(self, dirname, mmap=True, ltag_type=str):
+        self.dirname = dirname
+        self.mmap = mmap
+        self.ltag_type = ltag_type
+        self._params = None
+        self._cache = {}
+        self._cache_valid = None
+
+    @property
+    def _cache_dir(self):
+        return '{}/cache'.format(self.dirname)
+
+    def _stamp(self):
+        try:
+            stat = os.stat('{}/params.pkl'.format(self.dirname))
+        except OSError:
+            return None
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _has_cache(self):
+        # cache is used only when it is made from current params.pkl
+        if self._cache_valid is None:
+            try:
+                with open('{}/stamp.json'.format(self._cache_dir), encoding='utf-8') as f:
+                    stamp = json.load(f)
+            except (OSError, ValueError):
+                stamp = None
+            self._cache_valid = bool(self.mmap and stamp and stamp == self._stamp())
+        return self._cache_valid
+
+    def _load_params(self):
+        if self._params is None:
+            with open('{}/params.pkl'.format(self.dirname), 'rb') as f:
+                self._params = pickle.load(f)
+            self._write_cache()
+        return self._params
+
+    def _write_cache(self):
+        if not self.mmap or self._has_cache():
+            return
+        # written in a temporary directory and renamed, so a stopped process
+        # or a concurrent one does not leave partial cache
+        tmp = None
+        try:
+            tmp = tempfile.mkdtemp(prefix='.tmp-cache-', dir=self.dirname)
+            X = self._params['X'].tocsr()
+            for name in ['data', 'indices', 'indptr']:
+                np.save('{}/X_{}.npy'.format(tmp, name), getattr(X, name))
+            np.save('{}/X_shape.npy'.format(tmp), np.asarray(X.shape))
+            for name in ['idx_to_l', 'idx_to_lmorph']:
+                with open('{}/{}.jsonl'.format(tmp, name), 'w', encoding='utf-8') as f:
+                    for v in self._params[name]:
+                        f.write('{}\n'.format(json.dumps(v, ensure_ascii=False)))
+            with open('{}/stamp.json'.format(tmp), 'w', encoding='utf-8') as f:
+                json.dump(self._stamp(), f)
+            shutil.rmtree(self._cache_dir, ignore_errors=True)
+            os.replace(tmp, self._cache_dir)
+            self._cache_valid = True
+        except OSError:
+            # read-only installation. components are served from params.pkl
+            if tmp is not None:
+                shutil.rmtree(tmp, ignore_errors=True)
+
+    def _get(self, name, load):
+        if not (name in self._cache):
+            self._cache[name] = load()
+        return self._cache[name]
+
+    def _load_list(self, name):
+        if self._params is None and self._has_cache():
+            as_tuple = lambda v: tuple(v) if isinstance(v, list) else v
+            with open('{}/{}.jsonl'.format(self._cache_dir, name), encoding='utf-8') as f:
+                return [as_tuple(json.loads(line)) for line in f]
+        return self._load_params()[name]
+
+    def _load_text(self, name, dtype=str):
+        path = '{}/{}.txt'.format(self.dirname, name)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                return [dtype(line.rstrip('\n')) for line in f]
+        return self._load_params()[name]
+
+    def _load_X(self):
+        from scipy.sparse import csr_matrix
+        if self.mmap and not self._has_cache():
+            # creates cache
+            self._load_params()
+        if self._has_cache():
+            arrays = [np.load('{}/X_{}.npy'.format(self._cache_dir, name), mmap_mode='r')
+                      for name in ['data', 'indices', 'indptr']]
+            shape = tuple(np.load('{}/X_shape.npy'.format(self._cache_dir)).tolist())
+            return csr_matrix(tuple(arrays), shape=shape, copy=False)
+        return self._load_params()['X']
+
+    @property
+    def X(self):
+        """scipy.sparse.csr_matrix, (L, R) count sparse matrix. Read-only with mmap"""
+        return self._get('X', self._load_X)
+
+    @property
+    def idx_to_l(self):
+        """list, mapper from index to row value"""
+        return self._get('idx_to_l', lambda: self._load_list('idx_to_l'))
+
+    @property
+    def idx_to_lmorph(self):
+        """list of str, mapper from index to morpheme of row value"""
+        return self._get('idx_to_lmorph', lambda: self._load_list('idx_to_lmorph'))
+
+    @property
+    def idx_to_r(self):
+        """list of str, mapper from index to column value"""
+        return self._get('idx_to_r', lambda: self._load_text('idx_to_r'))
+
+    @property
+    def idx_to_ltag(self):
+        """list, mapper from index to pos tag (or label of LR_surface_noun) of row value"""
+        return self._get('idx_to_ltag', lambda: self._load_text('idx_to_ltag', self.ltag_type))
+
+    @property
+    def r_to_idx(self):
+        """dict, mapper from column value to index"""
+        return self._get('r_to_idx', lambda: {r:idx for idx, r in enumerate(self.idx_to_r)})
+
+    @property
+    def l_to_idx(self):
+        """dict, mapper from row value to index"""
+        return self._get('l_to_idx', lambda: {l:idx for idx, l in enumerate(self.idx_to_l)})
+
+    def ltag_indices(self, tag):
+        """It returns numpy.ndarray of row indices of which pos tag is `tag`"""
+        tags = self._get('_ltag_array', lambda: np.asarray(self.idx_to_ltag))
+        return np.flatnonzero(tags == tag)
+
+    def as_tuple(self):
+        """
+        It returns (X, idx_to_l, idx_to_r, idx_to_ltag, idx_to_lmorph).
+        The lists are copies, so callers can modify them. X is shared
+        """
+        return (self.X, list(self.idx_to_l), list(self.idx_to_r),
+                list(self.idx_to_ltag), list(self.idx_to_lmorph))
+
+def _dataset(name, ltag_type=str):
+    if not (name in _datasets):
+        _datasets[name] = LRSurfaceDataset('{}/{}'.format(installpath, name),
+            ltag_type=ltag_type)
+    return _datasets[name]
+
+def lr_surface_9tags():
+    """
+    Returns
+    -------
+    LRSurfaceDataset
+        Lazy dataset of LR_surface_9tags. Same object is returned in a process
+    """
+
+    return _dataset('LR_surface_9tags')
+
+def lr_surface_noun():
+    """
+    Returns
+    -------
+    LRSurfaceDataset
+        Lazy dataset of LR_surface_noun. Same object is returned in a process
+    """
+
+    # labels of idx_to_ltag.txt are 1 and -1
+    return _dataset('LR_surface_noun', ltag_type=int)
+
 def load_lr_surface(path):
     """
     Arguments
@@ -34,10 +246,12 @@ def load_lr_surface_9tags():
         Mapper from index to pos tag of row value
     idx_to_lmorph : list of str
         Mapper from index to morpheme of row value
+
+    The components are cached in the process and X is a read-only memory map.
+    See lr_surface_9tags
     """
 
-    path = '{}/LR_surface_9tags/params.pkl'.format(installpath)
-    return load_lr_surface(path)
+    return lr_surface_9tags().as_tuple()
 
 def load_lr_surface_noun():
     """
@@ -53,7 +267,9 @@ def load_lr_surface_noun():
         Mapper from index to pos tag of row value
     idx_to_lmorph : list of str
         Mapper from index to morpheme of row value
+
+    The components are cached in the process and X is a read-only memory map.
+    See lr_surface_noun
     """
 
-    path = '{}/LR_surface_noun/params.pkl'.format(installpath)
-    return load_lr_surface(path)
\ No newline at end of file
+    return lr_surface_noun().as_tuple()